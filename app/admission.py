@@ -0,0 +1,95 @@
+# app/admission.py
+"""
+Admission control для этапов пайплайна (энкодер, LLM).
+
+У каждого этапа свой StageLimiter: не больше max_concurrency одновременных
+выполнений, не больше max_queue ожидающих и не дольше max_wait_sec в очереди.
+Сверх этого запрос сразу отклоняется (Overloaded), чтобы не тратить работу на
+ответы, которые клиент уже не дождётся.
+
+Эндпоинты /ask синхронные и выполняются в threadpool, поэтому тут обычные
+threading-примитивы.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+
+class Overloaded(Exception):
+    """Этап перегружен: очередь полна (429) или истекло время ожидания (503)."""
+
+    def __init__(self, stage: str, reason: str, status_code: int, retry_after: int):
+        super().__init__(f"{stage}: {reason}")
+        self.stage = stage
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class StageLimiter:
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, max_wait_sec: float,
+                 retry_after_sec: int = 1):
+        self.name = name
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self.max_wait_sec = float(max_wait_sec)
+        self.retry_after_sec = int(retry_after_sec)
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected_queue_full = 0
+        self._rejected_timeout = 0
+
+    def acquire(self) -> None:
+        with self._cond:
+            if self._active < self.max_concurrency and self._waiting == 0:
+                self._active += 1
+                self._admitted += 1
+                return
+            if self._waiting >= self.max_queue:
+                self._rejected_queue_full += 1
+                raise Overloaded(self.name, "queue_full", 429, self.retry_after_sec)
+
+            self._waiting += 1
+            deadline = time.monotonic() + self.max_wait_sec
+            try:
+                while self._active >= self.max_concurrency:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        self._rejected_timeout += 1
+                        raise Overloaded(self.name, "queue_timeout", 503, self.retry_after_sec)
+                    self._cond.wait(left)
+            finally:
+                self._waiting -= 1
+            self._active += 1
+            self._admitted += 1
+
+    def release(self) -> None:
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "active": self._active,
+                "queue_depth": self._waiting,
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "admitted": self._admitted,
+                "rejected_queue_full": self._rejected_queue_full,
+                "rejected_timeout": self._rejected_timeout,
+            }
@@ -27,7 +27,25 @@ class Settings(BaseSettings):
     meta_path: str = Field(default="./faq_meta.pkl")
     bm25_path: str = Field(default="./bm25.pkl")
 
-    # Доля dense-скоринга: 1.0 — только FAISS, 0.0 — только BM25
+    # Инвертированный индекс по lexical_weights BGE-M3 (строит indexer.py)
+    # Переменная окружения: SPARSE_PATH
+    sparse_path: str = Field(default="./faq_sparse.pkl")
+
+    # Битовые маски фильтруемых полей (indexer.py --filter-fields)
+    # Переменная окружения: FILTERS_PATH
+    filters_path: str = Field(default="./faq_filters.pkl")
+
+    # Полные float32-векторы (indexer.py --compress) для точного рескоринга сжатого faq.index.
+    # Пусто — рескоринга нет (faq.index и так точный IndexFlatIP).
+    # Переменные окружения: VECTORS_PATH, RERANK_OVERSAMPLE (во сколько раз больше faiss_k брать из сжатого индекса)
+    vectors_path: Optional[str] = None
+    rerank_oversample: int = Field(default=2)
+
+    # Лексический канал гибрида: "bm25" | "sparse" (BGE-M3 lexical_weights) | "both"
+    # Переменная окружения: LEXICAL_MODE
+    lexical_mode: str = Field(default="bm25")
+
+    # Доля dense-скоринга: 1.0 — только FAISS, 0.0 — только лексический канал
     # Переменная окружения: HYBRID_ALPHA
     hybrid_alpha: float = Field(default=0.6)
 
@@ -51,6 +69,62 @@ class Settings(BaseSettings):
     max_fragment_chars: int = Field(default=800)
     max_context_chars: int = Field(default=600)
 
+    # === Cross-encoder ре-ранкинг (app/reranker.py) ===
+    # Включается только когда разница гибридных скоров top-1 и top-2 меньше порога;
+    # пересчитывает top_n кандидатов одним батчем, оценки кэшируются.
+    # Переменные окружения: RERANKER_ENABLED, RERANKER_MODEL, RERANKER_MARGIN,
+    # RERANKER_TOP_N, RERANKER_CACHE_SIZE
+    reranker_enabled: bool = Field(default=False)
+    reranker_model: str = Field(default="BAAI/bge-reranker-v2-m3")
+    reranker_margin: float = Field(default=0.05)
+    reranker_top_n: int = Field(default=5)
+    reranker_cache_size: int = Field(default=4096)
+
+    # Admission control для прямого прохода cross-encoder (см. ниже ENCODE_*).
+    # Очередь короткая: при отказе ре-ранкинг пропускается, запрос отвечает гибридным порядком.
+    # Переменные окружения: RERANKER_CONCURRENCY, RERANKER_QUEUE
+    reranker_concurrency: int = Field(default=1)
+    reranker_queue: int = Field(default=2)
+
+    # === Admission control (app/admission.py) ===
+    # Одновременных прогонов энкодера / вызовов LLM и длина очереди к каждому этапу.
+    # Переменные окружения: ENCODE_CONCURRENCY, ENCODE_QUEUE, LLM_CONCURRENCY, LLM_QUEUE
+    # Ожидающие в очереди занимают потоки threadpool FastAPI (по умолчанию 40), поэтому
+    # сумма concurrency + queue по всем этапам (ENCODE_*, LLM_*, RERANKER_*) должна быть
+    # меньше его размера: по умолчанию 10 + 24 + 3 = 37.
+    encode_concurrency: int = Field(default=2)
+    encode_queue: int = Field(default=8)
+    llm_concurrency: int = Field(default=8)
+    llm_queue: int = Field(default=16)
+
+    # Максимальное время ожидания в очереди этапа (сек), после него — 503
+    # Переменная окружения: ADMISSION_MAX_WAIT_SEC
+    admission_max_wait_sec: float = Field(default=5.0)
+
+    # Значение заголовка Retry-After в ответах 429/503 (сек)
+    # Переменная окружения: RETRY_AFTER_SEC
+    retry_after_sec: int = Field(default=2)
+
+    # === Профилирование (app/profiling.py) ===
+    # Токен админских функций: заголовок X-Admin-Token. Не задан — /admin/* выключены,
+    # а профилирование по заголовку X-Profile: 1 не включается.
+    # Переменная окружения: ADMIN_TOKEN
+    admin_token: Optional[str] = None
+
+    # Доля запросов /ask, которые профилируются сэмплером без заголовка (0.0 — никакие)
+    # Переменные окружения: PROFILE_SAMPLE_RATE, PROFILE_INTERVAL_MS
+    profile_sample_rate: float = Field(default=0.0)
+    profile_interval_ms: float = Field(default=5.0)
+
+    # Запросы дольше порога (сек) сохраняются с таймингами этапов, даже без профиля
+    # Переменная окружения: SLOW_REQUEST_SEC
+    slow_request_sec: float = Field(default=5.0)
+
+    # Кольцевой буфер снимков на диске
+    # Переменные окружения: CAPTURE_DIR, CAPTURE_MAX_ITEMS
+    capture_dir: str = Field(default="./captures")
+    capture_max_items: int = Field(default=100)
+
     # Настройки загрузки из .env, игнор лишних переменных, нечувствительность к порядку
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -4,7 +4,7 @@ from __future__ import annotations
 import json
 import re
 import time
-from typing import List, Optional
+from typing import Iterator, List, Optional
 
 import requests
 
@@ -62,6 +62,18 @@ def _trim_context(context: List[str], max_total: int, max_one: int) -> List[str]
             break
     return safe
 
+def _extract_delta(chunk) -> str:
+    """Текст из одного SSE-чанка: choices[0].delta.content (OpenAI-формат) или response[0].delta."""
+    if not isinstance(chunk, dict):
+        return ""
+    for key in ("choices", "response"):
+        items = chunk.get(key)
+        if isinstance(items, list) and items and isinstance(items[0], dict):
+            delta = items[0].get("delta") or items[0].get("message") or {}
+            if isinstance(delta, dict):
+                return delta.get("content") or ""
+    return ""
+
 # ==== FALLBACK-ЛОГИКА ====
 
 def _compose_refund_fallback(question: str, context: List[str]) -> Optional[str]:
@@ -120,9 +132,7 @@ class Generator:
         self.key = key or settings.genapi_key
         self.timeout = timeout if timeout is not None else settings.request_timeout_sec
 
-    def ask(self, question: str, context: List[str]) -> str:
-        # ограничиваем контекст
-        safe_ctx = _trim_context(context, settings.max_context_chars, settings.max_fragment_chars)
+    def _build_payload(self, question: str, safe_ctx: List[str]) -> dict:
         ctx_for_llm = "\n".join(f"[{i+1}] {c}" for i, c in enumerate(safe_ctx))
 
         system_prompt = (
@@ -133,7 +143,7 @@ class Generator:
 
         user_prompt = f"Контекст:\n{ctx_for_llm}\n\nВопрос: {question}\nОтвет:"
 
-        payload = {
+        return {
             "is_sync": True,
             "temperature": 0.0,
             "top_p": 0.9,
@@ -143,8 +153,7 @@ class Generator:
             ],
         }
 
-        answer = self._call_genapi(payload)
-
+    def _finalize(self, question: str, safe_ctx: List[str], answer: str) -> str:
         # если модель "сдалась" — включаем fallback
         if _looks_unknown(answer):
             for fb in (
@@ -160,6 +169,86 @@ class Generator:
 
         return _clean_refs(answer)
 
+    def ask(self, question: str, context: List[str]) -> str:
+        # ограничиваем контекст
+        safe_ctx = _trim_context(context, settings.max_context_chars, settings.max_fragment_chars)
+        answer = self._call_genapi(self._build_payload(question, safe_ctx))
+        return self._finalize(question, safe_ctx, answer)
+
+    def ask_stream(self, question: str, context: List[str]) -> Iterator[dict]:
+        """
+        Потоковый вариант ask(): отдаёт события
+        {"type": "token", "text": ...} по мере прихода дельт от GenAPI и в конце
+        {"type": "answer", "text": ...} — итоговый ответ после фолбэков и очистки ссылок.
+        Клиент должен заменить накопленные токены итоговым текстом.
+        """
+        safe_ctx = _trim_context(context, settings.max_context_chars, settings.max_fragment_chars)
+        payload = self._build_payload(question, safe_ctx)
+        payload["stream"] = True
+
+        parts: List[str] = []
+        for chunk in self._stream_genapi(payload):
+            parts.append(chunk)
+            yield {"type": "token", "text": chunk}
+
+        yield {"type": "answer", "text": self._finalize(question, safe_ctx, "".join(parts).strip())}
+
+    def _stream_genapi(self, payload: dict) -> Iterator[str]:
+        """
+        Читает SSE-поток GenAPI (строки 'data: {...}' с OpenAI-совместимыми дельтами).
+        Если сервер ответил обычным JSON, отдаём весь ответ одним куском.
+        Ошибки сети/HTTP отдаются одним куском в том же формате, что и у _call_genapi.
+        """
+        if not self.key:
+            yield "[GenAPI error] Missing GENAPI_KEY"
+            return
+        try:
+            resp = requests.post(
+                self.url,
+                headers={
+                    "Content-Type": "application/json",
+                    "Accept": "text/event-stream",
+                    "Authorization": f"Bearer {self.key}",
+                },
+                json=payload,
+                timeout=self.timeout,
+                stream=True,
+            )
+        except Exception as e:
+            yield f"[GenAPI exception] {e}"
+            return
+
+        with resp:
+            if resp.status_code != 200:
+                yield f"[GenAPI HTTP {resp.status_code}] {resp.text}"
+                return
+
+            if "text/event-stream" not in resp.headers.get("Content-Type", ""):
+                try:
+                    data = resp.json()
+                except Exception as e:
+                    yield f"[GenAPI parse error] {e}"
+                    return
+                yield self._parse_response(data)
+                return
+
+            # читаем байты и декодируем каждую строку как UTF-8: без charset в Content-Type
+            # requests взял бы ISO-8859-1, а str.splitlines() режет строку на байте 0x85 (есть в "х")
+            for raw_line in resp.iter_lines():
+                line = raw_line.decode("utf-8", errors="replace")
+                if not line or not line.startswith("data:"):
+                    continue
+                raw = line[len("data:"):].strip()
+                if raw == "[DONE]":
+                    break
+                try:
+                    data = json.loads(raw)
+                except ValueError:
+                    continue
+                delta = _extract_delta(data)
+                if delta:
+                    yield delta
+
     def _call_genapi(self, payload: dict) -> str:
         if not self.key:
             return "[GenAPI error] Missing GENAPI_KEY"
@@ -188,6 +277,10 @@ class Generator:
         except Exception as e:
             return f"[GenAPI parse error] {e}"
 
+        return self._parse_response(data)
+
+    @staticmethod
+    def _parse_response(data) -> str:
         # унифицированный парсинг
         if isinstance(data, dict):
             if "response" in data:
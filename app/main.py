@@ -1,13 +1,24 @@
 # app/main.py
 from __future__ import annotations
 
+import hmac
+import json
+import random
+import threading
 import time
-from fastapi import FastAPI, HTTPException
+from contextlib import contextmanager
+from typing import Optional
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
+from .admission import Overloaded, StageLimiter
 from .config import settings
-from .rag import Retriever
+from .rag import Retriever, UnknownFilterError
+from .reranker import AdaptiveReranker
 from .generator import Generator
+from .profiling import CaptureStore, StackSampler, end_timings, stage, start_timings
 from .schemas import AskRequest, AskResponse
 
 app = FastAPI(title="AI Support RAG", version="3.0")
@@ -20,12 +31,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+reranker = None
+rerank_limiter = None
+if settings.reranker_enabled:
+    rerank_limiter = StageLimiter(
+        "rerank",
+        max_concurrency=settings.reranker_concurrency,
+        max_queue=settings.reranker_queue,
+        max_wait_sec=settings.admission_max_wait_sec,
+        retry_after_sec=settings.retry_after_sec,
+    )
+    reranker = AdaptiveReranker(
+        settings.reranker_model,
+        margin=settings.reranker_margin,
+        top_n=settings.reranker_top_n,
+        cache_size=settings.reranker_cache_size,
+        slot=lambda: _stage_slot(rerank_limiter),
+    )
+    # модель грузим при старте: иначе её загрузку оплатит первый спорный запрос
+    reranker.load()
+
 retriever = Retriever(
     settings.index_path,
     settings.meta_path,
     settings.bm25_path,
     alpha=settings.hybrid_alpha,
     faiss_k=settings.faiss_k,
+    sparse_path=settings.sparse_path,
+    lexical=settings.lexical_mode,
+    vectors_path=settings.vectors_path,
+    rerank_oversample=settings.rerank_oversample,
+    filters_path=settings.filters_path,
+    reranker=reranker,
 )
 
 generator = Generator(
@@ -34,6 +71,33 @@ generator = Generator(
     timeout=settings.request_timeout_sec,
 )
 
+encode_limiter = StageLimiter(
+    "encode",
+    max_concurrency=settings.encode_concurrency,
+    max_queue=settings.encode_queue,
+    max_wait_sec=settings.admission_max_wait_sec,
+    retry_after_sec=settings.retry_after_sec,
+)
+
+llm_limiter = StageLimiter(
+    "llm",
+    max_concurrency=settings.llm_concurrency,
+    max_queue=settings.llm_queue,
+    max_wait_sec=settings.admission_max_wait_sec,
+    retry_after_sec=settings.retry_after_sec,
+)
+
+capture_store = CaptureStore(settings.capture_dir, max_items=settings.capture_max_items)
+
+
+@app.exception_handler(Overloaded)
+def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": f"overloaded: {exc}"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 
 def _trim(text: str, limit: int) -> str:
     if not text:
@@ -47,22 +111,215 @@ def _format_fragment(doc: dict, limit: int) -> str:
     return f"Вопрос: {q}\nОтвет: {a}"
 
 
+@contextmanager
+def _stage_slot(limiter: StageLimiter):
+    # ожидание в очереди и сама работа этапа — отдельными таймингами
+    with stage(f"{limiter.name}_wait"):
+        limiter.acquire()
+    try:
+        with stage(limiter.name):
+            yield
+    finally:
+        limiter.release()
+
+
+def _retrieve(req: AskRequest):
+    # фильтры проверяем до очереди к энкодеру, чтобы не тратить на кривой запрос слот
+    try:
+        retriever.validate_filters(req.filters)
+    except UnknownFilterError as e:
+        raise HTTPException(status_code=400, detail=f"bad_filter: {e}")
+    # энкодер — под encode_limiter; поиск по индексам дешёвый и идёт без очереди,
+    # а cross-encoder (если включён и сработал) внутри поиска занимает слот rerank_limiter
+    with _stage_slot(encode_limiter):
+        encoded = retriever.encode_query(req.question)
+    # search_total включает faiss, bm25/sparse и rerank_wait/rerank — не складывать с ними
+    with stage("search_total"):
+        return retriever.search_encoded(req.question, encoded, k=settings.top_k, filters=req.filters)
+
+
+def _is_admin(token: Optional[str]) -> bool:
+    if not settings.admin_token or token is None:
+        return False
+    # compare_digest на str падает с TypeError для не-ASCII, а заголовки приходят как latin-1
+    return hmac.compare_digest(token.encode("utf-8"), settings.admin_token.encode("utf-8"))
+
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    if not _is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="admin_token_required")
+
+
+def _should_profile(request: Request) -> bool:
+    if request.headers.get("X-Profile") == "1" and _is_admin(request.headers.get("X-Admin-Token")):
+        return True
+    return random.random() < settings.profile_sample_rate
+
+
+def _finish_capture(path: str, t0: float, timings: dict, sampler: Optional[StackSampler], status: str) -> None:
+    """Сохраняем снимок, если запрос профилировался или оказался медленнее порога."""
+    if sampler is not None:
+        sampler.stop()
+    latency = time.time() - t0
+    if sampler is None and latency < settings.slow_request_sec:
+        return
+    try:
+        capture_store.write({
+            "ts": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "path": path,
+            "status": status,
+            "latency_sec": round(latency, 3),
+            "reason": "profile" if sampler is not None else "slow",
+            "timings": timings,
+            "profile": sampler.to_dict() if sampler is not None else None,
+        })
+    except OSError:
+        # снимок — диагностика; ошибка записи на диск не должна ломать ответ
+        pass
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 
+@app.get("/admission")
+def admission():
+    """Глубина очередей и счётчики отказов по этапам — для автоскейлинга/мониторинга."""
+    stats = {"encode": encode_limiter.stats(), "llm": llm_limiter.stats()}
+    if rerank_limiter is not None:
+        stats["rerank"] = rerank_limiter.stats()
+    return stats
+
+
+@app.get("/rerank")
+def rerank_stats():
+    """Как часто срабатывал cross-encoder и сколько времени добавил."""
+    if reranker is None:
+        return {"enabled": False}
+    return {"enabled": True, **reranker.stats()}
+
+
+@app.get("/admin/captures", dependencies=[Depends(require_admin)])
+def list_captures():
+    """Снимки медленных/профилированных запросов, новые сверху."""
+    return {"captures": capture_store.list()}
+
+
+@app.get("/admin/captures/{capture_id}", dependencies=[Depends(require_admin)])
+def get_capture(capture_id: str):
+    cap = capture_store.get(capture_id)
+    if cap is None:
+        raise HTTPException(status_code=404, detail="capture_not_found")
+    return cap
+
+
 @app.post("/ask", response_model=AskResponse)
-def ask(req: AskRequest):
+def ask(req: AskRequest, request: Request):
     t0 = time.time()
+    sampler = None
+    if _should_profile(request):
+        sampler = StackSampler(interval_sec=settings.profile_interval_ms / 1000.0).start()
+    timings_token = start_timings()
+    status = "error"
     try:
-        docs = retriever.search(req.question, k=settings.top_k)
+        docs = _retrieve(req)
         context_full = [_format_fragment(d, settings.max_fragment_chars) for d in docs]
-        answer = generator.ask(req.question, context_full)
+        with _stage_slot(llm_limiter):
+            answer = generator.ask(req.question, context_full)
         context_short = [_trim(c, settings.max_context_chars) for c in context_full]
         latency = round(time.time() - t0, 2)
+        status = "ok"
         return AskResponse(answer=answer, context=context_short, latency_sec=latency)
+    except Overloaded:
+        status = "overloaded"
+        raise
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ask_failed: {e}")
+    finally:
+        _finish_capture("/ask", t0, end_timings(timings_token), sampler, status)
+
+
+def _ndjson(event: dict) -> bytes:
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+@app.post("/ask/stream")
+def ask_stream(req: AskRequest, request: Request):
+    """
+    Потоковый /ask в формате NDJSON (одно JSON-событие на строку):
+      {"type": "context", "context": [...], "retrieval_sec": ...} — сразу после поиска
+      {"type": "token", "text": ...}                            — дельты от LLM
+      {"type": "answer", "text": ...}                           — итоговый ответ (после фолбэков)
+      {"type": "done", "latency_sec": ...}
+    Ошибка после начала потока приходит событием {"type": "error", "detail": ...}.
+    При перегрузке отвечает 429/503 с Retry-After ещё до начала потока.
+    Тайминги и снимок (как у /ask) закрываются, когда поток закончился.
+    """
+    t0 = time.time()
+    sampler = None
+    if _should_profile(request):
+        sampler = StackSampler(interval_sec=settings.profile_interval_ms / 1000.0).start()
+    timings_token = start_timings()
+    status = "error"
+    try:
+        docs = _retrieve(req)
+        context_full = [_format_fragment(d, settings.max_fragment_chars) for d in docs]
+        context_short = [_trim(c, settings.max_context_chars) for c in context_full]
+        retrieval_sec = round(time.time() - t0, 2)
+
+        # слот LLM берём до начала потока, чтобы отказ ушёл нормальным 429/503,
+        # и держим его, пока поток не закончится
+        with stage("llm_wait"):
+            llm_limiter.acquire()
+        status = "streaming"
+    except Overloaded:
+        status = "overloaded"
+        raise
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"ask_failed: {e}")
+    finally:
+        # contextvar таймингов живёт в этом потоке; шаги потока идут в других — дальше пишем в словарь
+        timings = end_timings(timings_token)
+        if status != "streaming":
+            _finish_capture("/ask/stream", t0, timings, sampler, status)
+
+    # Завершение — ровно один раз: из finally генератора или, если клиент отвалился
+    # до первого чанка и генератор так и не стартовал, из background-задачи.
+    finish_once = threading.Lock()
+    outcome = {"status": "cancelled"}
+
+    def finish():
+        if finish_once.acquire(blocking=False):
+            llm_limiter.release()
+            _finish_capture("/ask/stream", t0, timings, sampler, outcome["status"])
+
+    def follow():
+        if sampler is not None:
+            sampler.follow_current_thread()
+
+    def events():
+        t_llm = time.perf_counter()
+        try:
+            follow()
+            yield _ndjson({"type": "context", "context": context_short, "retrieval_sec": retrieval_sec})
+            follow()
+            try:
+                for ev in generator.ask_stream(req.question, context_full):
+                    yield _ndjson(ev)
+                    follow()
+            except Exception as e:
+                outcome["status"] = "error"
+                yield _ndjson({"type": "error", "detail": f"ask_failed: {e}"})
+                return
+            outcome["status"] = "ok"
+            yield _ndjson({"type": "done", "latency_sec": round(time.time() - t0, 2)})
+        finally:
+            timings["llm"] = round(time.perf_counter() - t_llm, 4)
+            finish()
+
+    return StreamingResponse(events(), media_type="application/x-ndjson", background=BackgroundTask(finish))
@@ -0,0 +1,164 @@
+# app/profiling.py
+"""
+Профилирование запросов по требованию.
+
+- stage(name): замер времени этапа; пишет в словарь таймингов текущего запроса,
+  если он открыт через start_timings() (иначе — ничего, кроме perf_counter).
+- StackSampler: сэмплирующий профайлер одного потока на sys._current_frames();
+  результат — collapsed stacks (формат flamegraph.pl / speedscope) и self-time по функциям.
+- CaptureStore: кольцевой буфер снимков на диске (не больше max_items файлов).
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def start_timings():
+    """Открывает словарь таймингов для текущего запроса. Возвращает токен для end_timings()."""
+    return _timings.set({})
+
+
+def end_timings(token) -> Dict[str, float]:
+    d = _timings.get() or {}
+    _timings.reset(token)
+    return {k: round(v, 4) for k, v in d.items()}
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        d = _timings.get()
+        if d is not None:
+            d[name] = d.get(name, 0.0) + (time.perf_counter() - t0)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Раз в interval_sec снимает стек потока thread_id из фонового потока."""
+
+    def __init__(self, thread_id: Optional[int] = None, interval_sec: float = 0.005):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval_sec = float(interval_sec)
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "StackSampler":
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "StackSampler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def follow_current_thread(self) -> None:
+        """Дальше сэмплировать вызывающий поток (шаги потокового ответа идут в разных потоках threadpool)."""
+        self.thread_id = threading.get_ident()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_sec):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    def collapsed(self, limit: int = 200) -> List[str]:
+        """Строки 'root;...;leaf count', самые частые сверху."""
+        return [f"{stack} {n}" for stack, n in self.stacks.most_common(limit)]
+
+    def self_time(self, limit: int = 20) -> List[Dict[str, object]]:
+        """Функции, в которых поток был в момент сэмпла (листья стека), с долей от всех сэмплов."""
+        leaves: Counter = Counter()
+        for stack, n in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += n
+        total = max(1, self.samples)
+        return [{"frame": f, "samples": n, "share": round(n / total, 3)} for f, n in leaves.most_common(limit)]
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "interval_sec": self.interval_sec,
+            "samples": self.samples,
+            "self_time": self.self_time(),
+            "collapsed": self.collapsed(),
+        }
+
+
+_CAPTURE_ID = re.compile(r"^[0-9]+-[0-9a-f]{8}$")
+
+
+class CaptureStore:
+    """Снимки медленных/профилированных запросов: по файлу на снимок, старые удаляются сверх max_items."""
+
+    def __init__(self, directory: str, max_items: int = 100):
+        self.directory = directory
+        self.max_items = max(1, int(max_items))
+        self._lock = threading.Lock()
+        self._last_ns = 0
+
+    def write(self, capture: Dict[str, object]) -> str:
+        with self._lock:
+            # строго возрастающий префикс — порядок вытеснения не зависит от разрешения часов
+            self._last_ns = max(time.time_ns(), self._last_ns + 1)
+            capture_id = f"{self._last_ns}-{uuid.uuid4().hex[:8]}"
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, capture_id + ".json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"id": capture_id, **capture}, f, ensure_ascii=False)
+            for old in self._ids()[:-self.max_items]:
+                try:
+                    os.remove(os.path.join(self.directory, old + ".json"))
+                except FileNotFoundError:
+                    pass
+        return capture_id
+
+    def _ids(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        ids = [n[:-5] for n in os.listdir(self.directory) if n.endswith(".json") and _CAPTURE_ID.match(n[:-5])]
+        return sorted(ids, key=lambda i: (int(i.split("-")[0]), i))
+
+    def list(self) -> List[Dict[str, object]]:
+        """Краткий список снимков, новые сверху (без collapsed-стеков)."""
+        out = []
+        for capture_id in reversed(self._ids()):
+            cap = self.get(capture_id)
+            if cap is not None:
+                out.append({k: cap.get(k) for k in ("id", "ts", "path", "status", "latency_sec", "reason", "timings")})
+        return out
+
+    def get(self, capture_id: str) -> Optional[Dict[str, object]]:
+        if not _CAPTURE_ID.match(capture_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, capture_id + ".json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
@@ -1,9 +1,35 @@
+import os
+from typing import Dict, List, Optional, Union
+
 import faiss, pickle, numpy as np
 from rank_bm25 import BM25Okapi
 from FlagEmbedding import BGEM3FlagModel
 
+from .profiling import stage
+from .reranker import AdaptiveReranker
+
+# Лексический канал гибридного скора:
+#   "bm25"   — rank_bm25 по нашей токенизации (как раньше)
+#   "sparse" — lexical_weights BGE-M3 из того же прохода энкодера, что и dense
+#   "both"   — среднее двух нормированных скоров
+LEXICAL_MODES = ("bm25", "sparse", "both")
+
+# {"region": "msk"} или {"region": ["msk", "spb"], "language": "ru"}:
+# значения одного поля — ИЛИ, разные поля — И
+Filters = Dict[str, Union[str, List[str]]]
+
+
+class UnknownFilterError(ValueError):
+    """Фильтр по полю, которое indexer.py не индексировал (--filter-fields)."""
+
+
 class Retriever:
-    def __init__(self, index_path: str, meta_path: str, bm25_path: str, alpha: float = 0.6, faiss_k: int = 50):
+    def __init__(self, index_path: str, meta_path: str, bm25_path: str, alpha: float = 0.6, faiss_k: int = 50,
+                 sparse_path: str = "./faq_sparse.pkl", lexical: str = "bm25",
+                 vectors_path: Optional[str] = None, rerank_oversample: int = 2,
+                 filters_path: str = "./faq_filters.pkl", reranker: Optional[AdaptiveReranker] = None):
+        if lexical not in LEXICAL_MODES:
+            raise ValueError(f"lexical must be one of {LEXICAL_MODES}, got {lexical!r}")
         # Индексы/метаданные
         self.index = faiss.read_index(index_path)
         with open(meta_path, "rb") as f:
@@ -12,53 +38,170 @@ class Retriever:
             pack = pickle.load(f)
         self.bm25: BM25Okapi = pack["bm25"]
         self.corpus = pack["corpus"]  # тексты "Вопрос:\nОтвет:\n" в том же порядке, что и meta
+        # Инвертированный индекс по lexical_weights (см. indexer.py); грузим только если он нужен
+        self.postings = None
+        if lexical != "bm25":
+            with open(sparse_path, "rb") as f:
+                self.postings = pickle.load(f)["postings"]
+        # Битовые маски фильтруемых полей: field -> value -> packbits(mask). Файла нет — фильтров нет
+        self.filter_fields = {}
+        if filters_path and os.path.exists(filters_path):
+            with open(filters_path, "rb") as f:
+                self.filter_fields = pickle.load(f)["fields"]
+        # Полные float32-векторы для точного рескоринга сжатого индекса (indexer.py --compress).
+        # mmap: в RAM воркера попадают только прочитанные строки, page cache общий между процессами
+        self.vectors = np.load(vectors_path, mmap_mode="r") if vectors_path else None
+        self.rerank_oversample = max(1, int(rerank_oversample))
         # Модель энкодера
         self.model = BGEM3FlagModel("BAAI/bge-m3", use_fp16=True)
         # Гиперпараметры гибридного скора
         self.alpha = float(alpha)  # вес FAISS
         self.faiss_k = int(faiss_k)
+        self.lexical = lexical
+        # Cross-encoder для спорных случаев (близкие скоры лидеров); None — выключен
+        self.reranker = reranker
 
-    def _encode(self, text: str) -> np.ndarray:
-        v = self.model.encode([text])["dense_vecs"].astype("float32")
+    def encode_query(self, text: str):
+        """Один проход энкодера: (dense-вектор 1×d, lexical_weights или None)."""
+        out = self.model.encode([text], return_dense=True, return_sparse=self.postings is not None)
+        v = out["dense_vecs"].astype("float32").reshape(1, -1)
         faiss.normalize_L2(v)
-        return v
+        lex = out["lexical_weights"][0] if self.postings is not None else None
+        return v, lex
+
+    def _encode(self, text: str) -> np.ndarray:
+        return self.encode_query(text)[0]
 
     @staticmethod
     def _tokenize(text: str):
         text = "".join([c.lower() if (c.isalnum() or c.isspace()) else " " for c in text])
         return [t for t in text.split() if t]
 
-    def search(self, query_ru: str, k: int = 3):
+    @staticmethod
+    def _top_normalized(scores_arr: np.ndarray, n: int, doc_ids: Optional[np.ndarray] = None) -> dict:
+        """Топ-n документов по скору, нормированных на максимум. doc_ids — если scores_arr посчитан по подмножеству."""
+        top_idx = np.argsort(scores_arr)[::-1][:n]
+        s_max = float(np.max(scores_arr)) if scores_arr.size else 1.0
+        return {int(doc_ids[i] if doc_ids is not None else i): (float(scores_arr[i]) / s_max if s_max > 0 else 0.0)
+                for i in top_idx}
+
+    def validate_filters(self, filters: Optional[Filters]) -> None:
+        for field in (filters or {}):
+            if field not in self.filter_fields:
+                raise UnknownFilterError(f"unknown filter field: {field}")
+
+    def _filter_bitmap(self, filters: Optional[Filters]) -> Optional[np.ndarray]:
+        """Маска допустимых документов (packbits) из предпосчитанных масок; None — без фильтра."""
+        if not filters:
+            return None
+        self.validate_filters(filters)
+        result = None
+        for field, values in filters.items():
+            by_value = self.filter_fields[field]
+            if isinstance(values, str):
+                values = [values]
+            field_mask = np.zeros((len(self.meta) + 7) // 8, dtype=np.uint8)
+            for v in values:
+                bm = by_value.get(str(v).strip())
+                if bm is not None:
+                    field_mask |= bm
+            result = field_mask if result is None else (result & field_mask)
+        return result
+
+    def _faiss_search(self, qvec: np.ndarray, k: int, bitmap: Optional[np.ndarray]):
+        """index.search с IDSelectorBitmap: FAISS сам пропускает недопустимые id, без пересбора кандидатов."""
+        if bitmap is None:
+            return self.index.search(qvec, k)
+        # первый аргумент IDSelectorBitmap — длина маски в байтах, а не число документов
+        params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(bitmap.size, faiss.swig_ptr(bitmap)))
+        index = self.index
+        if isinstance(index, faiss.IndexPreTransform):
+            # селектор передаём во внутренний индекс, преобразование запроса делаем сами
+            qvec = index.apply_py(qvec)
+            index = faiss.downcast_index(index.index)
+        return index.search(qvec, k, params=params)
+
+    def _sparse_scores(self, lex: dict) -> np.ndarray:
+        """Скалярное произведение lexical_weights запроса со всеми документами по инвертированному индексу."""
+        scores = np.zeros(len(self.meta), dtype="float32")
+        for tok, q_w in lex.items():
+            posting = self.postings.get(tok)
+            if posting is not None:
+                ids, weights = posting
+                scores[ids] += float(q_w) * weights
+        return scores
+
+    def _dense_search(self, qvec: np.ndarray, bitmap: Optional[np.ndarray] = None):
+        """FAISS top-faiss_k. При сжатом индексе берём faiss_k*oversample кандидатов и пересчитываем их точно."""
+        if self.vectors is None:
+            sims, ids = self._faiss_search(qvec, self.faiss_k, bitmap)
+            return sims[0], ids[0]
+
+        _, ids = self._faiss_search(qvec, self.faiss_k * self.rerank_oversample, bitmap)
+        ids = np.sort(ids[0][ids[0] >= 0])  # упорядоченное чтение из mmap
+        sims = np.asarray(self.vectors[ids]) @ qvec[0]
+        order = np.argsort(-sims)[:self.faiss_k]
+        return sims[order], ids[order]
+
+    def search(self, query_ru: str, k: int = 3, filters: Optional[Filters] = None):
+        return self.search_encoded(query_ru, self.encode_query(query_ru), k=k, filters=filters)
+
+    def search_encoded(self, query_ru: str, encoded, k: int = 3, filters: Optional[Filters] = None):
+        """search() по уже посчитанному encode_query(query_ru) — для оценки без повторного энкодинга."""
+        qvec, qlex = encoded
+        bitmap = self._filter_bitmap(filters)
+        allowed = None
+        if bitmap is not None:
+            allowed = np.flatnonzero(np.unpackbits(bitmap, bitorder="little")[:len(self.meta)])
+
         # 1) FAISS
-        qvec = self._encode(query_ru)
-        sims, ids = self.index.search(qvec, self.faiss_k)  # побольше кандидатов
-        sims = sims[0]
-        ids = ids[0]
+        with stage("faiss"):
+            sims, ids = self._dense_search(qvec, bitmap)  # побольше кандидатов
 
         # нормализация FAISS-скор
         faiss_max = float(np.max(sims)) if sims.size else 1.0
         faiss_scores = {int(i): (float(s)/faiss_max if faiss_max > 0 else 0.0)
-                        for i, s in zip(ids, sims)}
+                        for i, s in zip(ids, sims) if i >= 0}
+
+        # 2) Лексический канал: BM25 и/или sparse BGE-M3 (берём такое же N, как faiss_k)
+        channels = []
+        if self.lexical in ("bm25", "both"):
+            with stage("bm25"):
+                tokens = self._tokenize(query_ru)
+                if allowed is None:
+                    bm25_scores_arr = self.bm25.get_scores(tokens)
+                else:
+                    # BM25 считаем только по допустимым документам
+                    bm25_scores_arr = np.asarray(self.bm25.get_batch_scores(tokens, allowed.tolist()))
+                channels.append(self._top_normalized(bm25_scores_arr, self.faiss_k, allowed))
+        if self.lexical in ("sparse", "both"):
+            with stage("sparse"):
+                sparse_arr = self._sparse_scores(qlex)
+                if allowed is not None:
+                    sparse_arr = sparse_arr[allowed]
+                channels.append(self._top_normalized(sparse_arr, self.faiss_k, allowed))
 
-        # 2) BM25
-        bm25_scores_arr = self.bm25.get_scores(self._tokenize(query_ru))
-        # топ-N BM25 (берём такое же N, как faiss_k)
-        bm25_top_idx = np.argsort(bm25_scores_arr)[::-1][:self.faiss_k]
-        bm25_max = float(np.max(bm25_scores_arr)) if bm25_scores_arr.size else 1.0
-        bm25_scores = {int(i): (float(bm25_scores_arr[i])/bm25_max if bm25_max > 0 else 0.0)
-                       for i in bm25_top_idx}
+        lex_scores = {}
+        for ch in channels:
+            for doc_id, s in ch.items():
+                lex_scores[doc_id] = lex_scores.get(doc_id, 0.0) + s / len(channels)
 
         # 3) Смешиваем
-        all_ids = set(list(faiss_scores.keys()) + list(bm25_scores.keys()))
+        all_ids = set(list(faiss_scores.keys()) + list(lex_scores.keys()))
         mixed = []
         for doc_id in all_ids:
             s_f = faiss_scores.get(doc_id, 0.0)
-            s_b = bm25_scores.get(doc_id, 0.0)
+            s_b = lex_scores.get(doc_id, 0.0)
             score = self.alpha * s_f + (1.0 - self.alpha) * s_b
             mixed.append((score, doc_id))
 
         mixed.sort(key=lambda x: x[0], reverse=True)
-        top = [doc_id for _, doc_id in mixed[:k]]
+        if self.reranker is not None:
+            # тайминг и очередь прямого прохода cross-encoder — в slot() реранкера
+            ranked = self.reranker.maybe_rerank(query_ru, mixed, self.corpus)
+        else:
+            ranked = [doc_id for _, doc_id in mixed]
+        top = ranked[:k]
 
         # Возвращаем метаданные (records) в порядке убывания смешанного скора
         return [self.meta[i] for i in top]
@@ -0,0 +1,132 @@
+# app/reranker.py
+"""
+Адаптивный cross-encoder ре-ранкинг.
+
+Запускается, только если гибридный скор не разделил лидеров: разница между
+первым и вторым кандидатом меньше margin. Тогда top_n кандидатов
+прогоняются через cross-encoder одним батчем, а оценки (query, doc_id)
+кэшируются в LRU. Счётчики показывают, как часто он срабатывал и сколько времени добавил.
+Ре-ранкинг необязателен: если slot() отказал (Overloaded), возвращается гибридный порядок.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Dict, List, Optional, Sequence, Tuple
+
+from .admission import Overloaded
+
+Scorer = Callable[[List[Tuple[str, str]]], List[float]]
+
+
+class AdaptiveReranker:
+    def __init__(self, model_name: str = "BAAI/bge-reranker-v2-m3", margin: float = 0.05, top_n: int = 5,
+                 cache_size: int = 4096, scorer: Optional[Scorer] = None,
+                 slot: Optional[Callable[[], ContextManager]] = None):
+        self.model_name = model_name
+        self.margin = float(margin)
+        self.top_n = max(2, int(top_n))
+        self.cache_size = max(0, int(cache_size))
+        # scorer(pairs) -> оценки; по умолчанию FlagReranker, см. load()
+        self._scorer = scorer
+        # slot() — контекст вокруг прямого прохода модели (admission control в app/main.py);
+        # кэш-хиты его не занимают
+        self._slot = slot or nullcontext
+        self._cache: "OrderedDict[Tuple[str, int], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._calls = 0
+        self._fired = 0
+        self._pairs_scored = 0
+        self._cache_hits = 0
+        self._shed = 0
+        self._total_sec = 0.0
+
+    def load(self) -> None:
+        """Загружает FlagReranker, если scorer не передан. Вызывать при старте, чтобы первый запрос не ждал модель."""
+        if self._scorer is None:
+            with self._load_lock:
+                if self._scorer is None:
+                    from FlagEmbedding import FlagReranker
+                    model = FlagReranker(self.model_name, use_fp16=True)
+                    self._scorer = lambda p: model.compute_score(p, normalize=True)
+
+    def _score(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        with self._slot():
+            scores = self._scorer(pairs)
+        # compute_score на одной паре возвращает число, а не список
+        return [float(scores)] if isinstance(scores, (int, float)) else [float(s) for s in scores]
+
+    def maybe_rerank(self, query: str, ranked: Sequence[Tuple[float, int]], texts: Sequence[str]) -> List[int]:
+        """
+        ranked — (fused_score, doc_id) по убыванию скора; texts[doc_id] — текст документа.
+        Возвращает doc_id в новом порядке (хвост после top_n не трогаем).
+        """
+        doc_ids = [doc_id for _, doc_id in ranked]
+        with self._lock:
+            self._calls += 1
+        if len(ranked) < 2 or ranked[0][0] - ranked[1][0] >= self.margin:
+            return doc_ids
+
+        # загрузка модели (если её не сделали при старте) не входит в added_ms_*
+        self.load()
+        t0 = time.perf_counter()
+        head = doc_ids[:self.top_n]
+        scores: Dict[int, float] = {}
+        with self._lock:
+            for doc_id in head:
+                cached = self._cache.get((query, doc_id))
+                if cached is not None:
+                    self._cache.move_to_end((query, doc_id))
+                    scores[doc_id] = cached
+        missing = [doc_id for doc_id in head if doc_id not in scores]
+        if missing:
+            # один батч на все некэшированные пары
+            try:
+                batch = self._score([(query, texts[doc_id]) for doc_id in missing])
+            except Overloaded:
+                # под нагрузкой ре-ранкинг сбрасываем, а не валим запрос: энкодер уже отработал
+                with self._lock:
+                    self._shed += 1
+                return doc_ids
+            for doc_id, s in zip(missing, batch):
+                scores[doc_id] = s
+
+        # sorted стабилен: при равных оценках сохраняется порядок гибридного скора
+        reordered = sorted(head, key=lambda d: -scores[d]) + doc_ids[self.top_n:]
+        elapsed = time.perf_counter() - t0
+
+        with self._lock:
+            for doc_id in missing:
+                self._cache[(query, doc_id)] = scores[doc_id]
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            self._fired += 1
+            self._pairs_scored += len(missing)
+            self._cache_hits += len(head) - len(missing)
+            self._total_sec += elapsed
+        return reordered
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "calls": self._calls,
+                "fired": self._fired,
+                "fire_rate": round(self._fired / self._calls, 4) if self._calls else 0.0,
+                "pairs_scored": self._pairs_scored,
+                "cache_hits": self._cache_hits,
+                "cache_size": len(self._cache),
+                "shed": self._shed,
+                "added_ms_total": round(1000 * self._total_sec, 2),
+                "added_ms_per_fire": round(1000 * self._total_sec / self._fired, 2) if self._fired else 0.0,
+                "added_ms_per_call": round(1000 * self._total_sec / self._calls, 2) if self._calls else 0.0,
+            }
+
+    def reset_stats(self, clear_cache: bool = False) -> None:
+        with self._lock:
+            if clear_cache:
+                self._cache.clear()
+            self._calls = self._fired = self._pairs_scored = self._cache_hits = self._shed = 0
+            self._total_sec = 0.0
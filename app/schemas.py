@@ -1,8 +1,11 @@
 from pydantic import BaseModel
-from typing import List
+from typing import Dict, List, Optional, Union
 
 class AskRequest(BaseModel):
     question: str
+    # Ограничение поиска по полям, проиндексированным indexer.py --filter-fields:
+    # {"region": "msk"} или {"region": ["msk", "spb"], "language": "ru"}
+    filters: Optional[Dict[str, Union[str, List[str]]]] = None
 
 class AskResponse(BaseModel):
     answer: str
@@ -0,0 +1,204 @@
+"""
+Оценка ретривера на размеченных парах «вопрос → строка FAQ» и подбор параметров смешивания.
+
+    python eval_retrieval.py --labels data/labels.csv \
+        --modes bm25,sparse --alphas 0.4,0.6,0.8 --faiss-ks 10,20,50 --top-ks 1,3,5 \
+        --out results/sweep.csv
+
+Файл разметки — CSV с колонками question, expected_row (номер строки в data/faq.csv, с нуля).
+Без --labels в качестве запросов берутся сами question_ru из базы (оценка оптимистичная,
+но годится для сравнения конфигураций между собой).
+
+Каждый вопрос кодируется ОДИН раз (dense + lexical_weights), дальше все конфигурации
+считаются по готовому энкодингу — поэтому latency в таблице — это чистое время поиска/смешивания.
+top_k на поиск не влияет (только срез выдачи), поэтому для всех top_k одной
+конфигурации (mode, alpha, faiss_k) используется один прогон.
+С --rerank в задержку входит и cross-encoder; отдельно печатается, в какой доле
+запросов он сработал и сколько добавил в среднем на запрос.
+
+В конце для каждого top_k печатается Парето-фронт: конфигурации, которые нельзя улучшить
+по recall/MRR, не проиграв в p50-задержке. Фронт строится отдельно по top_k, потому что
+качество с ростом k не падает, а задержка поиска от него не зависит. Выбор top_k —
+это компромисс с объёмом контекста для LLM, а не с задержкой поиска.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import itertools
+import statistics
+import time
+from typing import Dict, List, Sequence, Tuple
+
+
+def load_labels(path: str | None, faq_csv: str) -> List[Tuple[str, int]]:
+    """Пары (вопрос, ожидаемая строка)."""
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return [(row["question"], int(row["expected_row"])) for row in csv.DictReader(f)]
+    with open(faq_csv, encoding="utf-8") as f:
+        return [(row["question_ru"], i) for i, row in enumerate(csv.DictReader(f))]
+
+
+def recall_at_k(ranked: Sequence[int], expected: int, k: int) -> float:
+    return 1.0 if expected in ranked[:k] else 0.0
+
+
+def reciprocal_rank(ranked: Sequence[int], expected: int, k: int) -> float:
+    for pos, doc_id in enumerate(ranked[:k], start=1):
+        if doc_id == expected:
+            return 1.0 / pos
+    return 0.0
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
+
+
+def pareto_front(rows: Sequence[Dict[str, float]],
+                 maximize: Sequence[str] = ("recall", "mrr"),
+                 minimize: Sequence[str] = ("lat_ms_p50",)) -> List[Dict[str, float]]:
+    """Недоминируемые строки: нет другой, что не хуже по всем метрикам и строго лучше хотя бы по одной."""
+    def dominates(a, b) -> bool:
+        ge = all(a[m] >= b[m] for m in maximize) and all(a[m] <= b[m] for m in minimize)
+        gt = any(a[m] > b[m] for m in maximize) or any(a[m] < b[m] for m in minimize)
+        return ge and gt
+
+    front = [r for r in rows if not any(dominates(o, r) for o in rows if o is not r)]
+    return sorted(front, key=lambda r: r[minimize[0]])
+
+
+def pareto_by_top_k(rows: Sequence[Dict[str, float]]) -> Dict[int, List[Dict[str, float]]]:
+    """
+    Фронт отдельно для каждого top_k. Общий фронт бесполезен: recall@k и MRR@k не убывают
+    с ростом k, а задержка поиска от top_k не зависит — максимальный top_k доминировал бы всегда.
+    """
+    by_k: Dict[int, List[Dict[str, float]]] = {}
+    for r in rows:
+        by_k.setdefault(r["top_k"], []).append(r)
+    return {k: pareto_front(group) for k, group in sorted(by_k.items())}
+
+
+def evaluate_config(retriever, labels, encodings, top_ks: Sequence[int]) -> List[Dict[str, float]]:
+    """Один прогон поиска с текущими lexical/alpha/faiss_k ретривера -> строка на каждый top_k."""
+    # meta — список dict-ов в порядке строк CSV; номер строки восстанавливаем по идентичности объекта
+    pos = {id(r): i for i, r in enumerate(retriever.meta)}
+    max_k = max(top_ks)
+    rankings, lat = [], []
+    for (question, _), enc in zip(labels, encodings):
+        t0 = time.perf_counter()
+        docs = retriever.search_encoded(question, enc, k=max_k)
+        lat.append(time.perf_counter() - t0)
+        rankings.append([pos[id(d)] for d in docs])
+
+    lat_p50 = 1000 * statistics.median(lat) if lat else 0.0
+    lat_p95 = 1000 * percentile(lat, 0.95)
+    rr = retriever.reranker.stats() if retriever.reranker is not None else {}
+    n = max(1, len(labels))
+    rows = []
+    for k in top_ks:
+        rows.append({
+            "mode": retriever.lexical,
+            "alpha": retriever.alpha,
+            "faiss_k": retriever.faiss_k,
+            "top_k": k,
+            "recall": sum(recall_at_k(r, exp, k) for r, (_, exp) in zip(rankings, labels)) / n,
+            "mrr": sum(reciprocal_rank(r, exp, k) for r, (_, exp) in zip(rankings, labels)) / n,
+            "lat_ms_p50": lat_p50,
+            "lat_ms_p95": lat_p95,
+            "rerank_fire_rate": rr.get("fire_rate", 0.0),
+            "rerank_ms_per_call": rr.get("added_ms_per_call", 0.0),
+        })
+    return rows
+
+
+def _floats(s: str) -> List[float]:
+    return [float(x) for x in s.split(",") if x.strip()]
+
+
+def _ints(s: str) -> List[int]:
+    return [int(x) for x in s.split(",") if x.strip()]
+
+
+def _format_row(r: Dict[str, float]) -> str:
+    return (f"{r['mode']:>6}  alpha={r['alpha']:.2f}  faiss_k={r['faiss_k']:>4}  top_k={r['top_k']:>2}  "
+            f"recall={r['recall']:.3f}  mrr={r['mrr']:.3f}  "
+            f"p50={r['lat_ms_p50']:.2f}ms  p95={r['lat_ms_p95']:.2f}ms  "
+            f"rerank={r['rerank_fire_rate']:.2f} (+{r['rerank_ms_per_call']:.2f}ms)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Качество/задержка ретривера по сетке канал × alpha × faiss_k × top_k")
+    ap.add_argument("--labels", default=None, help="CSV с колонками question, expected_row")
+    ap.add_argument("--faq-csv", default="data/faq.csv")
+    ap.add_argument("--modes", default=None, help="лексические каналы через запятую; по умолчанию LEXICAL_MODE")
+    ap.add_argument("--alphas", default=None, help="по умолчанию HYBRID_ALPHA")
+    ap.add_argument("--faiss-ks", default=None, help="по умолчанию FAISS_K")
+    ap.add_argument("--top-ks", default=None, help="по умолчанию TOP_K")
+    ap.add_argument("--rerank", action="store_true",
+                    help="включить адаптивный cross-encoder (RERANKER_* из настроек) и показать частоту/цену срабатываний")
+    ap.add_argument("--out", default=None, help="CSV со всеми конфигурациями (например results/sweep.csv)")
+    args = ap.parse_args()
+
+    from app.config import settings
+    from app.rag import LEXICAL_MODES, Retriever
+    from app.reranker import AdaptiveReranker
+
+    modes = [m.strip() for m in (args.modes or settings.lexical_mode).split(",") if m.strip()]
+    unknown = [m for m in modes if m not in LEXICAL_MODES]
+    if unknown:
+        ap.error(f"неизвестные режимы {', '.join(unknown)}; допустимы: {', '.join(LEXICAL_MODES)}")
+    alphas = _floats(args.alphas) if args.alphas else [settings.hybrid_alpha]
+    faiss_ks = _ints(args.faiss_ks) if args.faiss_ks else [settings.faiss_k]
+    top_ks = sorted(_ints(args.top_ks)) if args.top_ks else [settings.top_k]
+
+    # "both" грузит и BM25, и sparse-индекс — дальше переключаем только параметры смешивания
+    retriever = Retriever(settings.index_path, settings.meta_path, settings.bm25_path,
+                          alpha=settings.hybrid_alpha, faiss_k=settings.faiss_k,
+                          sparse_path=settings.sparse_path,
+                          lexical="bm25" if modes == ["bm25"] else "both",
+                          vectors_path=settings.vectors_path, rerank_oversample=settings.rerank_oversample,
+                          filters_path=settings.filters_path)
+    if args.rerank:
+        retriever.reranker = AdaptiveReranker(settings.reranker_model, margin=settings.reranker_margin,
+                                              top_n=settings.reranker_top_n, cache_size=settings.reranker_cache_size)
+        retriever.reranker.load()  # загрузка модели не должна попасть в цену первой конфигурации
+    labels = load_labels(args.labels, args.faq_csv)
+
+    t0 = time.perf_counter()
+    encodings = [retriever.encode_query(q) for q, _ in labels]
+    enc_ms = 1000 * (time.perf_counter() - t0) / max(1, len(labels))
+    print(f"queries: {len(labels)}, encode (1 проход на вопрос): {enc_ms:.1f} ms/query")
+
+    rows = []
+    for mode, alpha, faiss_k in itertools.product(modes, alphas, faiss_ks):
+        retriever.lexical, retriever.alpha, retriever.faiss_k = mode, alpha, faiss_k
+        if retriever.reranker is not None:
+            # без кэша с прошлой конфигурации — иначе её цена занижается
+            retriever.reranker.reset_stats(clear_cache=True)
+        for r in evaluate_config(retriever, labels, encodings, top_ks):
+            rows.append(r)
+            print(_format_row(r))
+
+    if not rows:
+        print("нет вопросов для оценки")
+        return
+
+    for k, front in pareto_by_top_k(rows).items():
+        print(f"\nПарето-фронт для top_k={k} (recall, MRR ↑ / p50 ↓):")
+        for r in front:
+            print(_format_row(r))
+
+    if args.out:
+        with open(args.out, "w", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            w.writeheader()
+            w.writerows(rows)
+        print(f"\nсохранено: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
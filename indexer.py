@@ -1,48 +1,251 @@
 import os
+import time
+import argparse
+import multiprocessing as mp
 import pandas as pd, numpy as np, faiss, pickle
 from FlagEmbedding import BGEM3FlagModel
 from rank_bm25 import BM25Okapi
 
 CSV_PATH = os.getenv("FAQ_CSV_PATH", "data/faq.csv")  # по умолчанию рядом с проектом
 
-# === 1. Загружаем данные
-df = pd.read_csv(CSV_PATH)
-records = df.to_dict(orient="records")
 
 def make_doc(r):
     q = str(r.get("question_ru", "")).strip()
     a = str(r.get("answer_ru", "")).strip()
     return f"Вопрос: {q}\nОтвет: {a}"
 
-corpus = [make_doc(r) for r in records]
 
-# === 2. Эмбеддинги (BGE-M3, мультиязычная)
-model = BGEM3FlagModel("BAAI/bge-m3", use_fp16=True)
-enc = model.encode(corpus, batch_size=32)
-emb = np.array(enc["dense_vecs"]).astype("float32")
-faiss.normalize_L2(emb)
+def read_faq(path: str, filter_fields=()):
+    """
+    CSV базы. Колонки фильтров читаем как строки: иначе целочисленная колонка с пропусками
+    станет float, и значение "1" превратится в ключ "1.0", который запрос не найдёт.
+    """
+    columns = pd.read_csv(path, nrows=0).columns
+    missing = [f for f in filter_fields if f not in columns]
+    if missing:
+        raise SystemExit(f"нет колонок для фильтров в {path}: {', '.join(missing)}")
+    return pd.read_csv(path, dtype={f: str for f in filter_fields})
 
-# === 3. FAISS (inner product по L2-нормированным векторам)
-index = faiss.IndexFlatIP(emb.shape[1])
-index.add(emb)
 
-# === 4. BM25 по тем же текстам (вопрос+ответ)
 def tokenize(text: str):
     text = "".join([c.lower() if (c.isalnum() or c.isspace()) else " " for c in text])
     return [t for t in text.split() if t]
 
-bm25 = BM25Okapi([tokenize(doc) for doc in corpus])
 
-# === 5. Сохранение артефактов
-with open("faq_meta.pkl", "wb") as f:
-    pickle.dump(records, f)
+# === Параллельный энкодинг
+# Каждый воркер — отдельный процесс со своей копией модели и своим числом потоков torch.
+_worker_model = None
 
-with open("faq_embeddings.pkl", "wb") as f:
-    pickle.dump(emb, f)
 
-faiss.write_index(index, "faq.index")
+def _init_worker(threads: int):
+    global _worker_model
+    if threads:
+        # 0 — не трогаем число потоков torch (его значение по умолчанию)
+        import torch
+        torch.set_num_threads(threads)
+    _worker_model = BGEM3FlagModel("BAAI/bge-m3", use_fp16=True)
 
-with open("bm25.pkl", "wb") as f:
-    pickle.dump({"bm25": bm25, "corpus": corpus}, f)
 
-print("✅ Индексация завершена: encoded (вопрос+ответ), FAISS + BM25 готовы")
+def _encode_shard(task):
+    shard_id, idxs, texts, batch_size = task
+    t0 = time.time()
+    # dense и sparse (lexical_weights) за один проход энкодера
+    enc = _worker_model.encode(texts, batch_size=batch_size, return_dense=True, return_sparse=True)
+    elapsed = time.time() - t0
+    dense = np.array(enc["dense_vecs"]).astype("float32")
+    lexical = [dict(lw) for lw in enc["lexical_weights"]]
+    return shard_id, idxs, dense, lexical, elapsed
+
+
+def encode_corpus(corpus, workers: int = 1, threads_per_worker: int = 0, batch_size: int = 32):
+    """
+    Возвращает (dense float32 [n×d], lexical_weights [n]) в исходном порядке corpus.
+    Документы сортируются по длине — в батч попадают тексты близкой длины, меньше паддинга.
+    При workers > 1 отсортированный список раздаётся воркерам через один (order[w::workers]),
+    так что нагрузка по длинам примерно равная, а результат раскладывается обратно по индексам
+    документов — порядок детерминирован и не зависит от того, кто закончил первым.
+    """
+    order = sorted(range(len(corpus)), key=lambda i: len(corpus[i]))
+    workers = max(1, min(workers, len(corpus)))
+    # делим ядра между процессами только при workers > 1; один процесс без явного
+    # --threads-per-worker работает с числом потоков torch по умолчанию
+    threads = threads_per_worker or (max(1, (os.cpu_count() or 1) // workers) if workers > 1 else 0)
+    shards = [order[w::workers] for w in range(workers)]
+    tasks = [(w, idxs, [corpus[i] for i in idxs], batch_size) for w, idxs in enumerate(shards)]
+
+    if workers == 1:
+        if _worker_model is None:
+            _init_worker(threads)
+        results = [_encode_shard(tasks[0])]
+    else:
+        with mp.get_context("spawn").Pool(workers, initializer=_init_worker, initargs=(threads,)) as pool:
+            results = pool.map(_encode_shard, tasks)
+
+    dim = results[0][2].shape[1]
+    dense = np.empty((len(corpus), dim), dtype="float32")
+    lexical = [None] * len(corpus)
+    for shard_id, idxs, vecs, lws, elapsed in sorted(results, key=lambda r: r[0]):
+        dense[idxs] = vecs
+        for i, lw in zip(idxs, lws):
+            lexical[i] = lw
+        chars = sum(len(corpus[i]) for i in idxs)
+        print(f"   воркер {shard_id}: {len(idxs)} док. за {elapsed:.1f} c — "
+              f"{len(idxs) / max(elapsed, 1e-9):.1f} док/с, {chars / max(elapsed, 1e-9):.0f} симв/с "
+              f"({threads or 'по умолчанию'} потоков)")
+    return dense, lexical
+
+
+# Инвертированный индекс по lexical_weights BGE-M3: token_id -> (doc_ids, weights)
+def build_postings(lexical_weights):
+    acc = {}
+    for doc_id, lw in enumerate(lexical_weights):
+        for tok, w in lw.items():
+            ids, ws = acc.setdefault(tok, ([], []))
+            ids.append(doc_id)
+            ws.append(float(w))
+    return {tok: (np.array(ids, dtype="int64"), np.array(ws, dtype="float32"))
+            for tok, (ids, ws) in acc.items()}
+
+
+# Фильтруемые поля: для каждого значения — битовая маска документов (packbits, little bit order —
+# тот же формат, что ждёт faiss.IDSelectorBitmap)
+def build_filter_bitmaps(records, fields):
+    n = len(records)
+    out = {}
+    for field in fields:
+        masks = {}
+        for doc_id, r in enumerate(records):
+            v = r.get(field)
+            if v is None or (isinstance(v, float) and np.isnan(v)):
+                continue
+            masks.setdefault(str(v).strip(), np.zeros(n, dtype=bool))[doc_id] = True
+        out[field] = {v: np.packbits(m, bitorder="little") for v, m in masks.items()}
+    return out
+
+
+def build_compressed_index(emb: np.ndarray, dim: int, reduce: str):
+    """
+    Первая стадия поиска: снижение размерности (PCA или усечение первых dim координат,
+    Matryoshka-стиль) -> L2-нормировка -> int8 scalar quantization, inner product.
+    """
+    d = emb.shape[1]
+    if reduce == "pca":
+        return faiss.index_factory(d, f"PCA{dim},L2norm,SQ8", faiss.METRIC_INNER_PRODUCT)
+    sq = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    index = faiss.IndexPreTransform(sq)
+    index.prepend_transform(faiss.NormalizationTransform(dim, 2.0))
+    if dim < d:
+        index.prepend_transform(faiss.RemapDimensionsTransform(d, dim, False))
+    return index
+
+
+def report_compression(emb: np.ndarray, index, k: int = 10, oversample: int = 2, n_queries: int = 1000):
+    """
+    Память до/после и recall@k первой стадии и после точного рескоринга (запросы — сами документы).
+    Второй IndexFlatIP не строим: на больших базах он удвоил бы пиковую память индексатора —
+    размер float32 берём из emb.nbytes, точный top-k считаем по emb построчно.
+    """
+    full_mb = emb.nbytes / 2**20
+    comp_mb = faiss.serialize_index(index).nbytes / 2**20
+
+    rng = np.random.default_rng(0)
+    q_ids = rng.choice(len(emb), size=min(n_queries, len(emb)), replace=False)
+    queries = emb[q_ids]
+    k = min(k, len(emb))
+    _, approx = index.search(queries, min(len(emb), k * oversample))
+
+    recall_first, recall_rerank = [], []
+    for qi, q in enumerate(queries):
+        truth = set(np.argpartition(-(emb @ q), k - 1)[:k].tolist())
+        cand = approx[qi][approx[qi] >= 0]
+        recall_first.append(len(truth & set(cand[:k].tolist())) / k)
+        reranked = cand[np.argsort(-(emb[cand] @ q))][:k]
+        recall_rerank.append(len(truth & set(reranked.tolist())) / k)
+
+    print(f"   память индекса: {full_mb:.1f} MB (float32) -> {comp_mb:.1f} MB (x{full_mb / max(comp_mb, 1e-9):.1f})")
+    print(f"   recall@{k}: первая стадия {np.mean(recall_first):.3f}, "
+          f"после точного рескоринга top-{k * oversample}: {np.mean(recall_rerank):.3f}")
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Индексация FAQ: FAISS + BM25 + sparse (BGE-M3)")
+    ap.add_argument("--csv", default=CSV_PATH, help="CSV с колонками question_ru, answer_ru")
+    ap.add_argument("--compress", action="store_true",
+                    help="faq.index = сжатая первая стадия (снижение размерности + int8); полные float32-векторы "
+                         "пишутся в --vectors-out для memory-mapped точного рескоринга (VECTORS_PATH)")
+    ap.add_argument("--reduce", choices=("pca", "truncate"), default="pca",
+                    help="способ снижения размерности при --compress")
+    ap.add_argument("--dim", type=int, default=256, help="размерность первой стадии при --compress")
+    ap.add_argument("--vectors-out", default="faq_vectors.npy")
+    ap.add_argument("--workers", type=int, default=1, help="число процессов-энкодеров")
+    ap.add_argument("--threads-per-worker", type=int, default=0,
+                    help="потоков torch на процесс; 0 — cpu_count // workers при --workers > 1, "
+                         "иначе значение torch по умолчанию")
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--filter-fields", default="",
+                    help="колонки CSV через запятую, по которым можно фильтровать поиск (region,product,language)")
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # === 1. Загружаем данные
+    filter_fields = [f.strip() for f in args.filter_fields.split(",") if f.strip()]
+    df = read_faq(args.csv, filter_fields)
+    records = df.to_dict(orient="records")
+    corpus = [make_doc(r) for r in records]
+
+    # === 2. Эмбеддинги (BGE-M3, мультиязычная)
+    t0 = time.time()
+    emb, lexical_weights = encode_corpus(corpus, args.workers, args.threads_per_worker, args.batch_size)
+    print(f"   энкодинг: {len(corpus)} док. за {time.time() - t0:.1f} c ({args.workers} воркер(ов))")
+    faiss.normalize_L2(emb)
+
+    # === 3. FAISS (inner product по L2-нормированным векторам)
+    if args.compress:
+        dim = min(args.dim, emb.shape[1])
+        index = build_compressed_index(emb, dim, args.reduce)
+        index.train(emb)
+        index.add(emb)
+    else:
+        index = faiss.IndexFlatIP(emb.shape[1])
+        index.add(emb)
+
+    # === 4. BM25 по тем же текстам (вопрос+ответ)
+    bm25 = BM25Okapi([tokenize(doc) for doc in corpus])
+    postings = build_postings(lexical_weights)
+
+    # === 5. Сохранение артефактов
+    with open("faq_meta.pkl", "wb") as f:
+        pickle.dump(records, f)
+
+    if args.compress:
+        # полные векторы — только на диске, Retriever открывает их через np.load(mmap_mode="r")
+        np.save(args.vectors_out, emb)
+    else:
+        with open("faq_embeddings.pkl", "wb") as f:
+            pickle.dump(emb, f)
+
+    faiss.write_index(index, "faq.index")
+
+    with open("bm25.pkl", "wb") as f:
+        pickle.dump({"bm25": bm25, "corpus": corpus}, f)
+
+    with open("faq_sparse.pkl", "wb") as f:
+        pickle.dump({"postings": postings, "n_docs": len(corpus)}, f)
+
+    with open("faq_filters.pkl", "wb") as f:
+        pickle.dump({"fields": build_filter_bitmaps(records, filter_fields), "n_docs": len(corpus)}, f)
+
+    print("✅ Индексация завершена: encoded (вопрос+ответ), FAISS + BM25 + sparse (BGE-M3) готовы")
+    if filter_fields:
+        print(f"   фильтры: {', '.join(filter_fields)}")
+    if args.compress:
+        print(f"   faq.index: {args.reduce.upper()}{dim} + SQ8; полные векторы: {args.vectors_out} "
+              f"(задайте VECTORS_PATH={args.vectors_out} для точного рескоринга)")
+        report_compression(emb, index)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+from app.admission import Overloaded, StageLimiter
+
+
+def test_admits_up_to_concurrency():
+    lim = StageLimiter("encode", max_concurrency=2, max_queue=0, max_wait_sec=0.1)
+    lim.acquire()
+    lim.acquire()
+    assert lim.stats()["active"] == 2
+    lim.release()
+    lim.release()
+    assert lim.stats()["active"] == 0
+    assert lim.stats()["admitted"] == 2
+
+
+def test_queue_full_rejects_with_429():
+    lim = StageLimiter("llm", max_concurrency=1, max_queue=0, max_wait_sec=1.0, retry_after_sec=3)
+    lim.acquire()
+    with pytest.raises(Overloaded) as ei:
+        lim.acquire()
+    assert ei.value.status_code == 429
+    assert ei.value.retry_after == 3
+    assert lim.stats()["rejected_queue_full"] == 1
+
+
+def test_queue_timeout_rejects_with_503():
+    lim = StageLimiter("llm", max_concurrency=1, max_queue=1, max_wait_sec=0.05)
+    lim.acquire()
+    t0 = time.monotonic()
+    with pytest.raises(Overloaded) as ei:
+        lim.acquire()
+    assert ei.value.status_code == 503
+    assert time.monotonic() - t0 < 1.0
+    stats = lim.stats()
+    assert stats["rejected_timeout"] == 1
+    assert stats["queue_depth"] == 0
+
+
+def test_waiter_gets_slot_after_release():
+    lim = StageLimiter("encode", max_concurrency=1, max_queue=1, max_wait_sec=2.0)
+    lim.acquire()
+    got = threading.Event()
+
+    def waiter():
+        with lim.slot():
+            got.set()
+
+    th = threading.Thread(target=waiter)
+    th.start()
+    while lim.stats()["queue_depth"] == 0:
+        time.sleep(0.005)
+    lim.release()
+    th.join(timeout=2.0)
+    assert got.is_set()
+    assert lim.stats()["active"] == 0
@@ -20,3 +20,61 @@ def test_ask_stub(monkeypatch):
     assert "answer" in body
     assert body["answer"] == "stub answer"
     assert "context" in body
+
+def test_ask_stream_stub(monkeypatch):
+    import json
+    from app import main
+    def fake_stream(q, ctx):
+        yield {"type": "token", "text": "stub "}
+        yield {"type": "token", "text": "answer"}
+        yield {"type": "answer", "text": "stub answer"}
+    monkeypatch.setattr(main.generator, "ask_stream", fake_stream)
+
+    r = client.post("/ask/stream", json={"question": "Тестовый вопрос"})
+    assert r.status_code == 200
+    events = [json.loads(line) for line in r.text.splitlines() if line]
+    assert events[0]["type"] == "context"
+    assert isinstance(events[0]["context"], list)
+    assert [e["text"] for e in events if e["type"] == "token"] == ["stub ", "answer"]
+    assert [e for e in events if e["type"] == "answer"][0]["text"] == "stub answer"
+    assert events[-1]["type"] == "done"
+
+def test_ask_unknown_filter_field():
+    r = client.post("/ask", json={"question": "Тестовый вопрос", "filters": {"no_such_field": "x"}})
+    assert r.status_code == 400
+    assert "bad_filter" in r.json()["detail"]
+
+def test_non_ascii_admin_token_is_rejected(monkeypatch):
+    from app import main
+    monkeypatch.setattr(main.settings, "admin_token", "secret")
+    monkeypatch.setattr(main.generator, "ask", lambda q, ctx: "stub answer")
+    bad = {"X-Admin-Token": "sécret".encode("utf-8").decode("latin-1")}
+
+    r = client.get("/admin/captures", headers=bad)
+    assert r.status_code == 403
+    r = client.post("/ask", json={"question": "Тестовый вопрос"}, headers={**bad, "X-Profile": "1"})
+    assert r.status_code == 200
+
+def test_ask_stream_is_profiled_and_captured_after_stream(monkeypatch, tmp_path):
+    import json
+    from app import main
+    from app.profiling import CaptureStore
+    store = CaptureStore(str(tmp_path))
+    monkeypatch.setattr(main, "capture_store", store)
+    monkeypatch.setattr(main.settings, "admin_token", "secret")
+
+    def fake_stream(q, ctx):
+        yield {"type": "token", "text": "stub"}
+        yield {"type": "answer", "text": "stub"}
+    monkeypatch.setattr(main.generator, "ask_stream", fake_stream)
+
+    r = client.post("/ask/stream", json={"question": "Тестовый вопрос"},
+                    headers={"X-Profile": "1", "X-Admin-Token": "secret"})
+    assert r.status_code == 200
+    assert json.loads(r.text.splitlines()[-1])["type"] == "done"
+
+    caps = store.list()
+    assert len(caps) == 1
+    assert caps[0]["path"] == "/ask/stream" and caps[0]["status"] == "ok"
+    assert {"encode", "search_total", "llm_wait", "llm"} <= set(caps[0]["timings"])
+    assert main.llm_limiter.stats()["active"] == 0
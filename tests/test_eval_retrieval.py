@@ -0,0 +1,32 @@
+from eval_retrieval import pareto_by_top_k, pareto_front, recall_at_k, reciprocal_rank
+
+
+def test_recall_and_mrr():
+    ranked = [7, 3, 5]
+    assert recall_at_k(ranked, 3, 1) == 0.0
+    assert recall_at_k(ranked, 3, 2) == 1.0
+    assert reciprocal_rank(ranked, 5, 3) == 1.0 / 3
+    assert reciprocal_rank(ranked, 5, 2) == 0.0
+
+
+def test_pareto_front_drops_dominated():
+    rows = [
+        {"name": "fast", "recall": 0.80, "mrr": 0.70, "lat_ms_p50": 1.0},
+        {"name": "best", "recall": 0.95, "mrr": 0.85, "lat_ms_p50": 3.0},
+        {"name": "worse", "recall": 0.90, "mrr": 0.80, "lat_ms_p50": 4.0},
+        {"name": "dup_fast", "recall": 0.80, "mrr": 0.70, "lat_ms_p50": 1.0},
+    ]
+    names = [r["name"] for r in pareto_front(rows)]
+    assert names == ["fast", "dup_fast", "best"]
+
+
+def test_pareto_is_computed_per_top_k():
+    rows = [
+        {"name": "a1", "top_k": 1, "recall": 0.6, "mrr": 0.6, "lat_ms_p50": 1.0},
+        {"name": "b1", "top_k": 1, "recall": 0.7, "mrr": 0.7, "lat_ms_p50": 2.0},
+        {"name": "a5", "top_k": 5, "recall": 0.9, "mrr": 0.7, "lat_ms_p50": 1.0},
+        {"name": "b5", "top_k": 5, "recall": 0.95, "mrr": 0.75, "lat_ms_p50": 2.0},
+    ]
+    fronts = pareto_by_top_k(rows)
+    # top_k=5 доминирует все строки top_k=1, но фронт top_k=1 не пустеет
+    assert {k: [r["name"] for r in f] for k, f in fronts.items()} == {1: ["a1", "b1"], 5: ["a5", "b5"]}
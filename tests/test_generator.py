@@ -0,0 +1,83 @@
+import json
+
+from app import generator as gen_mod
+from app.generator import Generator, _extract_delta
+
+
+class FakeStreamResponse:
+    """Минимальный requests.Response для stream=True: тело отдаётся байтами, как у настоящего."""
+
+    def __init__(self, body: bytes, status_code: int = 200, content_type: str = "text/event-stream"):
+        self._body = body
+        self.status_code = status_code
+        self.headers = {"Content-Type": content_type}
+        # как у requests, когда в Content-Type text/* нет charset
+        self.encoding = "ISO-8859-1"
+
+    @property
+    def text(self) -> str:
+        return self._body.decode(self.encoding)
+
+    def json(self):
+        return json.loads(self._body.decode("utf-8"))
+
+    def iter_lines(self, decode_unicode=False):
+        if decode_unicode:
+            return iter(self._body.decode(self.encoding).splitlines())
+        return iter(self._body.splitlines())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _sse(*deltas: str) -> bytes:
+    lines = [
+        "data: " + json.dumps({"choices": [{"delta": {"content": d}}]}, ensure_ascii=False)
+        for d in deltas
+    ]
+    return ("\n\n".join(lines) + "\n\ndata: [DONE]\n\n").encode("utf-8")
+
+
+def _stream(monkeypatch, resp):
+    monkeypatch.setattr(gen_mod.requests, "post", lambda *a, **kw: resp)
+    return list(Generator(url="http://genapi", key="k")._stream_genapi({}))
+
+
+def test_extract_delta_formats():
+    assert _extract_delta({"choices": [{"delta": {"content": "при"}}]}) == "при"
+    assert _extract_delta({"response": [{"delta": {"content": "вет"}}]}) == "вет"
+    assert _extract_delta({"choices": [{"delta": {}}]}) == ""
+    assert _extract_delta({"choices": []}) == ""
+    assert _extract_delta("not a dict") == ""
+
+
+def test_stream_genapi_cyrillic_deltas_without_charset(monkeypatch):
+    # в UTF-8 "х" — это d1 85; 0x85 не должен считаться переводом строки
+    chunks = _stream(monkeypatch, FakeStreamResponse(_sse("Всё ", "хорошо", ", спасибо")))
+    assert chunks == ["Всё ", "хорошо", ", спасибо"]
+
+
+def test_stream_genapi_stops_at_done(monkeypatch):
+    body = _sse("один") + 'data: {"choices": [{"delta": {"content": "лишнее"}}]}\n\n'.encode("utf-8")
+    assert _stream(monkeypatch, FakeStreamResponse(body)) == ["один"]
+
+
+def test_stream_genapi_plain_json_reply(monkeypatch):
+    body = json.dumps({"choices": [{"message": {"content": " Готово "}}]}, ensure_ascii=False).encode("utf-8")
+    resp = FakeStreamResponse(body, content_type="application/json")
+    assert _stream(monkeypatch, resp) == ["Готово"]
+
+
+def test_stream_genapi_http_error(monkeypatch):
+    chunks = _stream(monkeypatch, FakeStreamResponse(b"rate limited", status_code=429))
+    assert chunks == ["[GenAPI HTTP 429] rate limited"]
+
+
+def test_ask_stream_answer_matches_tokens(monkeypatch):
+    monkeypatch.setattr(gen_mod.requests, "post", lambda *a, **kw: FakeStreamResponse(_sse("Всё ", "хорошо, спасибо")))
+    events = list(Generator(url="http://genapi", key="k").ask_stream("Как дела?", []))
+    assert [e["text"] for e in events if e["type"] == "token"] == ["Всё ", "хорошо, спасибо"]
+    assert events[-1] == {"type": "answer", "text": "Всё хорошо, спасибо"}
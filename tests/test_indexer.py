@@ -0,0 +1,72 @@
+import numpy as np
+
+import indexer
+
+
+class FakeModel:
+    """Энкодер-заглушка: вектор и веса однозначно выводятся из текста."""
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, batch_size=32, return_dense=True, return_sparse=False):
+        self.calls.append(list(texts))
+        return {
+            "dense_vecs": np.array([[float(len(t)), float(ord(t[0]))] for t in texts], dtype="float32"),
+            "lexical_weights": [{t: 1.0} for t in texts],
+        }
+
+
+def test_encode_corpus_restores_input_order(monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(indexer, "_worker_model", model)
+    corpus = ["cccc", "a", "bbbbbb", "dd", "eee"]
+
+    dense, lexical = indexer.encode_corpus(corpus, workers=1, threads_per_worker=1)
+
+    # модель получила тексты, отсортированные по длине
+    assert model.calls == [sorted(corpus, key=len)]
+    # а результат разложен обратно в порядке входа
+    assert dense[:, 0].tolist() == [float(len(t)) for t in corpus]
+    assert dense[:, 1].tolist() == [float(ord(t[0])) for t in corpus]
+    assert lexical == [{t: 1.0} for t in corpus]
+
+
+def test_single_worker_keeps_torch_default_threads(monkeypatch):
+    requested = []
+
+    def fake_init(threads):
+        requested.append(threads)
+        monkeypatch.setattr(indexer, "_worker_model", FakeModel())
+
+    monkeypatch.setattr(indexer, "_worker_model", None)
+    monkeypatch.setattr(indexer, "_init_worker", fake_init)
+    indexer.encode_corpus(["a", "bb"], workers=1)
+    monkeypatch.setattr(indexer, "_worker_model", None)
+    indexer.encode_corpus(["a", "bb"], workers=1, threads_per_worker=3)
+    # 0 — set_num_threads не вызывается; явное значение передаётся как есть
+    assert requested == [0, 3]
+
+
+def _bit(bitmap, i):
+    # тот же доступ к биту, что в faiss::IDSelectorBitmap::is_member
+    return (int(bitmap[i >> 3]) >> (i & 7)) & 1
+
+
+def test_read_faq_keeps_filter_values_as_strings(tmp_path):
+    path = tmp_path / "faq.csv"
+    path.write_text("question_ru,answer_ru,region\nq1,a1,1\nq2,a2,\nq3,a3,2\n", encoding="utf-8")
+    records = indexer.read_faq(str(path), ["region"]).to_dict(orient="records")
+    bitmaps = indexer.build_filter_bitmaps(records, ["region"])
+    assert sorted(bitmaps["region"]) == ["1", "2"]
+
+
+def test_filter_bitmaps_little_endian_layout():
+    regions = ["msk", "spb", "msk", None, "spb", "msk", "ekb", "msk", "spb", "msk"]  # 10 док. — 2 байта
+    records = [{"region": r} for r in regions]
+    bitmaps = indexer.build_filter_bitmaps(records, ["region"])["region"]
+
+    assert sorted(bitmaps) == ["ekb", "msk", "spb"]
+    for value, bm in bitmaps.items():
+        assert bm.dtype == np.uint8 and bm.shape == (2,)
+        assert [i for i in range(len(regions)) if _bit(bm, i)] == [i for i, r in enumerate(regions) if r == value]
@@ -0,0 +1,58 @@
+import threading
+import time
+
+from app.profiling import CaptureStore, StackSampler, end_timings, stage, start_timings
+
+
+def _busy_loop(sec: float) -> int:
+    n = 0
+    t_end = time.perf_counter() + sec
+    while time.perf_counter() < t_end:
+        n += 1
+    return n
+
+
+def test_stage_timings_only_inside_request():
+    with stage("outside"):
+        pass
+    token = start_timings()
+    with stage("encode"):
+        time.sleep(0.01)
+    with stage("encode"):
+        time.sleep(0.01)
+    timings = end_timings(token)
+    assert set(timings) == {"encode"}
+    assert timings["encode"] >= 0.02
+
+
+def test_sampler_sees_busy_function():
+    sampler = StackSampler(interval_sec=0.002).start()
+    _busy_loop(0.2)
+    sampler.stop()
+    assert sampler.samples > 0
+    assert any("_busy_loop" in line for line in sampler.collapsed())
+    assert sampler.to_dict()["self_time"]
+
+
+def test_capture_store_is_bounded(tmp_path):
+    store = CaptureStore(str(tmp_path), max_items=3)
+    ids = [store.write({"path": "/ask", "latency_sec": float(i)}) for i in range(5)]
+    listed = [c["id"] for c in store.list()]
+    assert listed == list(reversed(ids[-3:]))
+    assert store.get(ids[0]) is None
+    assert store.get(ids[-1])["latency_sec"] == 4.0
+    assert store.get("../etc/passwd") is None
+
+
+def test_sampler_follows_current_thread():
+    sampler = StackSampler(thread_id=0)
+    done = []
+
+    def worker():
+        sampler.follow_current_thread()
+        done.append(threading.get_ident())
+
+    t = threading.Thread(target=worker)
+    t.start()
+    t.join()
+    assert sampler.thread_id == done[0]
@@ -1,7 +1,120 @@
-from app.rag import Retriever
+import numpy as np
+import pytest
+
+from app.rag import Retriever, UnknownFilterError
 from app.config import settings
+from indexer import build_filter_bitmaps, build_postings
 
 def test_search():
     r = Retriever(settings.index_path, settings.meta_path, settings.bm25_path)
     res = r.search("Как получить поддержку?", k=2)
     assert len(res) > 0
+
+
+def _bare_retriever(n_docs: int, **attrs):
+    """Retriever без загрузки индексов и модели — для проверки чистой логики скоринга."""
+    r = Retriever.__new__(Retriever)
+    r.meta = [{"row": i} for i in range(n_docs)]
+    for name, value in attrs.items():
+        setattr(r, name, value)
+    return r
+
+
+def test_sparse_postings_round_trip():
+    lexical_weights = [{"10": 0.5, "20": 0.1}, {"20": 0.3}, {}, {"10": 0.2, "30": 1.0}]
+    postings = build_postings(lexical_weights)
+    assert sorted(postings) == ["10", "20", "30"]
+    ids, ws = postings["10"]
+    assert ids.tolist() == [0, 3]
+    assert np.allclose(ws, [0.5, 0.2])
+
+    r = _bare_retriever(len(lexical_weights), postings=postings)
+    scores = r._sparse_scores({"10": 2.0, "20": 1.0, "99": 5.0})  # "99" нет в индексе
+    # скалярное произведение весов запроса и документа по общим токенам
+    assert np.allclose(scores, [2.0 * 0.5 + 0.1, 0.3, 0.0, 2.0 * 0.2])
+
+
+def test_filter_bitmap_or_within_field_and_across_fields():
+    records = [
+        {"region": "msk", "language": "ru"},
+        {"region": "spb", "language": "ru"},
+        {"region": "msk", "language": "en"},
+        {"region": "ekb", "language": "ru"},
+        {"region": "spb", "language": "en"},
+        {"region": "msk", "language": "ru"},
+        {"region": "spb", "language": "ru"},
+        {"region": "msk", "language": "ru"},
+        {"region": "spb", "language": "ru"},
+    ]
+    r = _bare_retriever(len(records), filter_fields=build_filter_bitmaps(records, ["region", "language"]))
+
+    def allowed(filters):
+        bm = r._filter_bitmap(filters)
+        return np.flatnonzero(np.unpackbits(bm, bitorder="little")[:len(records)]).tolist()
+
+    assert r._filter_bitmap(None) is None
+    assert allowed({"region": "msk"}) == [0, 2, 5, 7]
+    assert allowed({"region": ["msk", "spb"]}) == [0, 1, 2, 4, 5, 6, 7, 8]
+    assert allowed({"region": ["msk", "spb"], "language": "en"}) == [2, 4]
+    assert allowed({"region": "nowhere"}) == []
+
+    with pytest.raises(UnknownFilterError):
+        r._filter_bitmap({"product": "x"})
+
+
+@pytest.mark.parametrize("reduce", ["pca", "truncate"])
+def test_compressed_index_exact_rerank_matches_flat(tmp_path, reduce):
+    import faiss
+    from indexer import build_compressed_index
+
+    rng = np.random.default_rng(0)
+    emb = rng.standard_normal((300, 64)).astype("float32")
+    faiss.normalize_L2(emb)
+
+    index = build_compressed_index(emb, 16, reduce)
+    index.train(emb)
+    index.add(emb)
+    if reduce == "truncate":
+        assert isinstance(faiss.downcast_VectorTransform(index.chain.at(0)), faiss.RemapDimensionsTransform)
+
+    np.save(tmp_path / "faq_vectors.npy", emb)
+    # faiss_k * oversample больше числа документов: FAISS дополнит выдачу id = -1, их надо отбросить,
+    # а точный рескоринг по всем кандидатам обязан совпасть с полным перебором
+    r = _bare_retriever(len(emb), index=index, faiss_k=5, rerank_oversample=80,
+                        vectors=np.load(tmp_path / "faq_vectors.npy", mmap_mode="r"))
+
+    flat = faiss.IndexFlatIP(emb.shape[1])
+    flat.add(emb)
+    for doc_id in (0, 17, 123):
+        q = emb[doc_id:doc_id + 1] + 0.01 * rng.standard_normal((1, 64)).astype("float32")
+        faiss.normalize_L2(q)
+        sims, ids = r._dense_search(q)
+        flat_sims, flat_ids = flat.search(q, 5)
+        assert ids.tolist() == flat_ids[0].tolist()
+        assert np.allclose(sims, flat_sims[0], atol=1e-5)
+
+
+@pytest.mark.parametrize("kind", ["flat", "pretransform_sq8"])
+def test_faiss_search_applies_bitmap_inside_index(kind):
+    import faiss
+    from indexer import build_compressed_index
+
+    rng = np.random.default_rng(1)
+    emb = rng.standard_normal((50, 32)).astype("float32")
+    faiss.normalize_L2(emb)
+    if kind == "flat":
+        index = faiss.IndexFlatIP(emb.shape[1])
+    else:
+        index = build_compressed_index(emb, 16, "truncate")
+        index.train(emb)
+    index.add(emb)
+
+    records = [{"region": "msk" if i % 7 == 0 else "spb"} for i in range(len(emb))]
+    r = _bare_retriever(len(emb), index=index, filter_fields=build_filter_bitmaps(records, ["region"]))
+    bitmap = r._filter_bitmap({"region": "msk"})
+    allowed = {i for i in range(len(emb)) if i % 7 == 0}
+
+    # запрос — сам недопустимый документ: без фильтра он был бы первым
+    _, ids = r._faiss_search(emb[1:2], 10, bitmap)
+    found = [i for i in ids[0].tolist() if i >= 0]
+    assert set(found) == allowed
@@ -0,0 +1,99 @@
+from app.reranker import AdaptiveReranker
+
+
+TEXTS = ["doc0", "doc1", "doc2", "doc3"]
+
+
+class FakeScorer:
+    """Cross-encoder-заглушка: оценка — из словаря по тексту документа."""
+
+    def __init__(self, by_text):
+        self.by_text = by_text
+        self.batches = []
+
+    def __call__(self, pairs):
+        self.batches.append(list(pairs))
+        return [self.by_text[doc] for _, doc in pairs]
+
+
+def test_skips_when_margin_is_clear():
+    scorer = FakeScorer({})
+    rr = AdaptiveReranker(margin=0.05, top_n=3, scorer=scorer)
+    assert rr.maybe_rerank("q", [(0.9, 0), (0.5, 1), (0.4, 2)], TEXTS) == [0, 1, 2]
+    assert scorer.batches == []
+    assert rr.stats()["fired"] == 0
+    assert rr.stats()["calls"] == 1
+
+
+def test_reranks_head_in_one_batch_and_caches():
+    scorer = FakeScorer({"doc0": 0.1, "doc1": 0.9, "doc2": 0.5})
+    rr = AdaptiveReranker(margin=0.05, top_n=3, scorer=scorer)
+    ranked = [(0.80, 0), (0.79, 1), (0.78, 2), (0.10, 3)]
+
+    assert rr.maybe_rerank("q", ranked, TEXTS) == [1, 2, 0, 3]
+    assert len(scorer.batches) == 1 and len(scorer.batches[0]) == 3
+
+    assert rr.maybe_rerank("q", ranked, TEXTS) == [1, 2, 0, 3]
+    assert len(scorer.batches) == 1  # второй раз — из кэша
+
+    st = rr.stats()
+    assert st["fired"] == 2 and st["fire_rate"] == 1.0
+    assert st["pairs_scored"] == 3 and st["cache_hits"] == 3
+
+
+def test_cache_is_bounded():
+    scorer = FakeScorer({"doc0": 0.1, "doc1": 0.9})
+    rr = AdaptiveReranker(margin=0.05, top_n=2, cache_size=2, scorer=scorer)
+    rr.maybe_rerank("q1", [(0.5, 0), (0.5, 1)], TEXTS)
+    rr.maybe_rerank("q2", [(0.5, 0), (0.5, 1)], TEXTS)
+    assert rr.stats()["cache_size"] == 2
+
+
+def test_slot_wraps_only_model_forward_pass():
+    from contextlib import contextmanager
+
+    entered = []
+
+    @contextmanager
+    def slot():
+        entered.append(1)
+        yield
+
+    scorer = FakeScorer({"doc0": 0.1, "doc1": 0.9})
+    rr = AdaptiveReranker(margin=0.05, top_n=2, scorer=scorer, slot=slot)
+    rr.maybe_rerank("q", [(0.5, 0), (0.5, 1)], TEXTS)
+    rr.maybe_rerank("q", [(0.5, 0), (0.5, 1)], TEXTS)  # кэш — слот не нужен
+    rr.maybe_rerank("q", [(0.9, 0), (0.1, 1)], TEXTS)  # не сработал
+    assert len(entered) == 1
+
+
+def test_model_load_is_not_counted_in_added_latency(monkeypatch):
+    import time
+
+    rr = AdaptiveReranker(margin=0.05, top_n=2)
+
+    def slow_load():
+        time.sleep(0.2)
+        rr._scorer = FakeScorer({"doc0": 0.1, "doc1": 0.9})
+
+    monkeypatch.setattr(rr, "load", slow_load)
+    rr.maybe_rerank("q", [(0.5, 0), (0.5, 1)], TEXTS)
+    assert rr.stats()["added_ms_total"] < 100
+
+
+def test_overloaded_slot_sheds_rerank_and_keeps_fused_order():
+    from contextlib import contextmanager
+
+    from app.admission import Overloaded
+
+    @contextmanager
+    def full_slot():
+        raise Overloaded("rerank", "queue full", 429, 1)
+        yield
+
+    scorer = FakeScorer({"doc0": 0.1, "doc1": 0.9})
+    rr = AdaptiveReranker(margin=0.05, top_n=2, scorer=scorer, slot=full_slot)
+    assert rr.maybe_rerank("q", [(0.5, 0), (0.5, 1)], TEXTS) == [0, 1]
+    assert scorer.batches == []
+    st = rr.stats()
+    assert st["shed"] == 1 and st["fired"] == 0 and st["cache_size"] == 0
@@ -1,11 +1,15 @@
 import os
 import time
 import html
+import json
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
 
 # === Настройки ===
 DEFAULT_API_URL = os.getenv("API_URL", "http://localhost:8000/ask")
+# Потоковый эндпоинт по умолчанию — <API URL>/stream
+STREAM_API_URL = os.getenv("STREAM_API_URL", "")
 APP_TITLE = "🤖 AI Support RAG"
 APP_DESC = "Задай вопрос — получи ответ от RAG (FAISS+BM25) + GPT-4 Omni (GenAPI), с показом контекста."
 
@@ -61,7 +65,7 @@ with st.sidebar:
 
 # === Состояние ===
 if "history" not in st.session_state:
-    # элементы: (question, answer_html, context_list, latency_sec, ok)
+    # элементы: (question, answer_html, context_list, latency_sec, ttft_sec, ok)
     st.session_state.history = []
 
 if clear_btn:
@@ -78,20 +82,58 @@ with col_inp:
 with col_btn:
     ask_clicked = st.button("Спросить", type="primary", use_container_width=True)
 
-def call_api(question: str, url: str) -> dict:
-    """POST /ask FastAPI. Возвращает dict с answer/context либо ошибку."""
+@st.cache_resource
+def get_session() -> requests.Session:
+    """Одна HTTP-сессия с пулом keep-alive соединений на процесс Streamlit (переживает rerun-ы)."""
+    sess = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    sess.mount("http://", adapter)
+    sess.mount("https://", adapter)
+    return sess
+
+def stream_url_for(url: str) -> str:
+    return STREAM_API_URL or (url.rstrip("/") + "/stream")
+
+def call_api_stream(question: str, url: str, on_context, on_token) -> dict:
+    """
+    POST <url>/stream (NDJSON). on_context(list) вызывается, как только пришёл контекст,
+    on_token(str) — с накопленным текстом ответа на каждый токен.
+    Возвращает dict с answer/context, _latency (полная) и _ttft (до первого токена) либо ошибку.
+    """
+    t0 = time.time()
+    ttft = None
+    answer, context = "", []
     try:
-        t0 = time.time()
-        r = requests.post(url, json={"question": question}, timeout=60)
-        latency = time.time() - t0
-        if r.status_code == 200:
-            data = r.json()
-            data["_ok"] = True
-            data["_latency"] = latency
-            return data
-        return {"_ok": False, "_latency": latency, "error": f"HTTP {r.status_code}: {r.text}"}
+        with get_session().post(stream_url_for(url), json={"question": question},
+                                stream=True, timeout=(5, 60)) as r:
+            if r.status_code != 200:
+                return {"_ok": False, "_latency": time.time() - t0, "_ttft": None,
+                        "error": f"HTTP {r.status_code}: {r.text}"}
+            for line in r.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                ev = json.loads(line)
+                kind = ev.get("type")
+                if kind == "context":
+                    context = ev.get("context", [])
+                    on_context(context)
+                elif kind == "token":
+                    if ttft is None:
+                        ttft = time.time() - t0
+                    answer += ev.get("text", "")
+                    on_token(answer)
+                elif kind == "answer":
+                    if ttft is None:
+                        ttft = time.time() - t0
+                    answer = ev.get("text", "")
+                    on_token(answer)
+                elif kind == "error":
+                    return {"_ok": False, "_latency": time.time() - t0, "_ttft": ttft,
+                            "error": ev.get("detail", "unknown")}
+        return {"_ok": True, "_latency": time.time() - t0, "_ttft": ttft,
+                "answer": answer, "context": context}
     except Exception as e:
-        return {"_ok": False, "_latency": 0.0, "error": str(e)}
+        return {"_ok": False, "_latency": time.time() - t0, "_ttft": ttft, "error": str(e)}
 
 def as_html_with_br(text: str) -> str:
     """Экранируем HTML и сохраняем переводы строк как <br/>."""
@@ -102,45 +144,82 @@ def html_to_plain(a_html: str) -> str:
     """Преобразует нашу HTML-строку (escape + <br/>) обратно в обычный текст для st.error()."""
     return html.unescape(a_html.replace("<br/>", "\n"))
 
+def render_context(ctx_list):
+    if ctx_list:
+        for i, ctx in enumerate(ctx_list, start=1):
+            ctx_html = html.escape(ctx).replace("\n", "<br/>")
+            st.markdown(f"**Источник [{i}]**")
+            st.markdown(f"<div class='ctx'>{ctx_html}</div>", unsafe_allow_html=True)
+            st.markdown("<span class='small'>Совпадение извлечено FAISS/BM25</span>",
+                        unsafe_allow_html=True)
+            st.markdown("<div class='divider'></div>", unsafe_allow_html=True)
+    else:
+        st.info("Контекст не возвращён (возможно, индекс пуст или запрос нерелевантен).")
+
+def timing_caption(lat: float, ttft) -> str:
+    ttft_part = f" • первый токен: {ttft:.2f} c" if ttft is not None else ""
+    return f"⏱ Время ответа: {lat:.2f} c{ttft_part} • API: {api_url}"
+
 # === Обработка запроса ===
+# Текущий ответ рисуем вживую, а в историю он попадает уже готовым — поэтому
+# в этом прогоне последний элемент истории не рендерим повторно.
+skip_last = False
 if ask_clicked and user_q.strip():
-    resp = call_api(user_q.strip(), api_url)
-    if resp.get("_ok"):
-        st.session_state.history.append((
-            user_q.strip(),
-            as_html_with_br(resp.get("answer", "")),
-            resp.get("context", []),
-            resp.get("_latency", 0.0),
-            True
-        ))
-    else:
-        st.session_state.history.append((
-            user_q.strip(),
-            as_html_with_br(f"Ошибка: {resp.get('error','unknown')}"),
-            [],
-            resp.get("_latency", 0.0),
-            False
-        ))
+    with st.container():
+        st.markdown(f"**❓ Вопрос:** {html.escape(user_q.strip())}")
+        answer_ph = st.empty()
+        answer_ph.markdown("<div class='answer'><b>⏳ Ищем контекст…</b></div>", unsafe_allow_html=True)
+        ctx_ph = st.empty()
+
+        def on_context(ctx_list):
+            with ctx_ph.container():
+                with st.expander("📚 Показать контекст (фрагменты из базы знаний)"):
+                    render_context(ctx_list)
+            answer_ph.markdown("<div class='answer'><b>⏳ Генерируем ответ…</b></div>", unsafe_allow_html=True)
+
+        def on_token(text):
+            answer_ph.markdown(
+                f"""<div class="answer"><b>✅ Ответ:</b><br/>{as_html_with_br(text)}</div>""",
+                unsafe_allow_html=True,
+            )
+
+        resp = call_api_stream(user_q.strip(), api_url, on_context, on_token)
+        if resp.get("_ok"):
+            st.caption(timing_caption(resp.get("_latency", 0.0), resp.get("_ttft")))
+            st.session_state.history.append((
+                user_q.strip(),
+                as_html_with_br(resp.get("answer", "")),
+                resp.get("context", []),
+                resp.get("_latency", 0.0),
+                resp.get("_ttft"),
+                True
+            ))
+        else:
+            answer_ph.empty()
+            st.error(f"Ошибка: {resp.get('error','unknown')}")
+            st.caption(f"⏱ Попытка запроса заняла: {resp.get('_latency', 0.0):.2f} c • API: {api_url}")
+            st.session_state.history.append((
+                user_q.strip(),
+                as_html_with_br(f"Ошибка: {resp.get('error','unknown')}"),
+                [],
+                resp.get("_latency", 0.0),
+                resp.get("_ttft"),
+                False
+            ))
+        st.markdown("<div class='divider'></div>", unsafe_allow_html=True)
+    skip_last = True
 
 # === Рендер истории (последние сверху) ===
-for q, a_html, ctx_list, lat, ok in reversed(st.session_state.history):
+shown = st.session_state.history[:-1] if skip_last else st.session_state.history
+for q, a_html, ctx_list, lat, ttft, ok in reversed(shown):
     with st.container():
         st.markdown(f"**❓ Вопрос:** {html.escape(q)}")
         if ok:
             st.markdown(f"""<div class="answer"><b>✅ Ответ:</b><br/>{a_html}</div>""", unsafe_allow_html=True)
             with st.expander("📚 Показать контекст (фрагменты из базы знаний)"):
-                if ctx_list:
-                    for i, ctx in enumerate(ctx_list, start=1):
-                        ctx_html = html.escape(ctx).replace("\n", "<br/>")
-                        st.markdown(f"**Источник [{i}]**")
-                        st.markdown(f"<div class='ctx'>{ctx_html}</div>", unsafe_allow_html=True)
-                        st.markdown("<span class='small'>Совпадение извлечено FAISS/BM25</span>",
-                                    unsafe_allow_html=True)
-                        st.markdown("<div class='divider'></div>", unsafe_allow_html=True)
-                else:
-                    st.info("Контекст не возвращён (возможно, индекс пуст или запрос нерелевантен).")
-
-            st.caption(f"⏱ Время ответа: {lat:.2f} c • API: {api_url}")
+                render_context(ctx_list)
+
+            st.caption(timing_caption(lat, ttft))
         else:
             plain_err = html_to_plain(a_html)
             st.error(plain_err)